@@ -0,0 +1,124 @@
+"""
+Compact binary container for the search index
+Layout:
+    magic (8 bytes) | header length (uint32) | JSON header | sections...
+The JSON header lists each section's offset, length and array typecode.
+Sections are flat arrays (uint32 ids and offsets, float coordinates, utf-8
+blobs), aligned to 8 bytes, so they can be used straight from a read-only
+mmap: loading costs no parsing and the pages are shared between workers.
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Sequence, Union
+
+from .fileio import atomic_write
+
+MAGIC = b"TIDXv1\0\0"
+ALIGN = 8
+
+Section = Union[array, bytes]
+
+
+def _pad(length: int) -> int:
+    return (ALIGN - length % ALIGN) % ALIGN
+
+
+def write_index_file(path: str, sections: Dict[str, Section], meta: Optional[Dict] = None):
+    """Write sections to path atomically"""
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        typecode = data.typecode if isinstance(data, array) else "B"
+        size = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        layout[name] = [offset, len(data), typecode]
+        offset += size + _pad(size)
+
+    header = json.dumps({
+        "byteorder": sys.byteorder,
+        "sections": layout,
+        "meta": meta or {},
+    }).encode("utf-8")
+    # Sections start on an aligned offset
+    header += b" " * _pad(len(MAGIC) + 4 + len(header))
+
+    with atomic_write(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for name, data in sections.items():
+            raw = data.tobytes() if isinstance(data, array) else bytes(data)
+            f.write(raw)
+            f.write(b"\0" * _pad(len(raw)))
+
+
+class MappedIndex:
+    """Read-only, memory-mapped view of an index file"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a search index file")
+        (header_len,) = struct.unpack_from("<I", self._mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(self._mm[start:start + header_len]))
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built on a {header['byteorder']}-endian machine")
+
+        self.meta: Dict = header.get("meta", {})
+        base = start + header_len
+        view = memoryview(self._mm)
+        self.sections: Dict[str, memoryview] = {}
+        for name, (offset, length, typecode) in header["sections"].items():
+            itemsize = array(typecode).itemsize
+            raw = view[base + offset:base + offset + length * itemsize]
+            self.sections[name] = raw if typecode == "B" else raw.cast(typecode)
+
+
+class StringTable:
+    """Interned strings stored as one utf-8 blob plus an offsets array"""
+
+    def __init__(self, offsets: Sequence[int], blob: Union[bytes, memoryview]):
+        self.offsets = offsets
+        self.blob = blob
+
+    @staticmethod
+    def build(strings: List[str]) -> Dict[str, Section]:
+        offsets = array("I", [0])
+        blob = bytearray()
+        for s in strings:
+            blob += s.encode("utf-8")
+            offsets.append(len(blob))
+        return {"offsets": offsets, "blob": bytes(blob)}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, i: int) -> str:
+        return self.raw(i).decode("utf-8")
+
+
+def bisect_strings(strings: StringTable, keys: Sequence[int], target: str) -> int:
+    """
+    Position of target in keys, an array of string ids sorted by string value,
+    or -1. UTF-8 byte order matches code point order, so no decoding is needed.
+    """
+    needle = target.encode("utf-8")
+    lo, hi = 0, len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        value = strings.raw(keys[mid])
+        if value < needle:
+            lo = mid + 1
+        elif value > needle:
+            hi = mid
+        else:
+            return mid
+    return -1
@@ -0,0 +1,116 @@
+"""
+Server-Sent Events broadcast hub
+Payloads are encoded once per data change and the same bytes are fanned
+out to every connected screen through bounded per-client queues
+"""
+import asyncio
+import json
+from typing import AsyncIterator, Callable, List, Optional, Set, Tuple
+
+
+def sse_message(payload: dict, event: Optional[str] = None, event_id: Optional[str] = None,
+                retry_ms: Optional[int] = None) -> bytes:
+    """Encode a payload as a single SSE message"""
+    lines = []
+    if retry_ms is not None:
+        lines.append(f"retry: {retry_ms}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(payload, default=str)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class PayloadCache:
+    """
+    JSON payload encoded once and reused until its version key changes.
+    Shared by the polling endpoint and SSE snapshots.
+    """
+
+    def __init__(self, build: Callable[[], dict]):
+        self.build = build
+        self.hits = 0
+        self.misses = 0
+        self._key: Optional[Tuple] = None
+        self._body = b""
+        self._etag = ""
+
+    def get(self, key: Tuple) -> Tuple[bytes, str]:
+        """Encoded body (single line of JSON) and its strong ETag, derived from the key"""
+        if key != self._key:
+            self.misses += 1
+            self._body = json.dumps(self.build(), default=str).encode("utf-8")
+            self._etag = '"' + "-".join(str(part) for part in key) + '"'
+            self._key = key
+        else:
+            self.hits += 1
+        return self._body, self._etag
+
+    def invalidate(self):
+        self._key = None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class Broadcaster:
+    """Fans pre-encoded SSE messages out to all subscribers"""
+
+    HEARTBEAT = b": heartbeat\n\n"
+
+    # Queued in place of messages a slow client missed; it gets a full snapshot instead
+    RESYNC = object()
+
+    def __init__(self, queue_size: int = 8, heartbeat_seconds: float = 15):
+        self.queue_size = queue_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self.resyncs = 0
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def queue_depths(self) -> List[int]:
+        """Number of messages waiting for each subscriber"""
+        return [queue.qsize() for queue in self._subscribers]
+
+    def publish(self, message: bytes):
+        """Queue a message for every subscriber"""
+        for queue in self._subscribers:
+            if queue.full():
+                # The client fell behind and patches can't be skipped: resync it
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.RESYNC)
+                self.resyncs += 1
+            else:
+                queue.put_nowait(message)
+
+    async def stream(self, initial: Callable[[], bytes],
+                     snapshot: Callable[[], bytes]) -> AsyncIterator[bytes]:
+        """
+        Yield the initial message for this client, then every published one,
+        with heartbeat comments in between.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        try:
+            # Built after subscribing so no published message can be missed
+            yield initial()
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    message = self.HEARTBEAT
+                if message is self.RESYNC:
+                    message = snapshot()
+                yield message
+        finally:
+            self._subscribers.discard(queue)
@@ -1,17 +1,188 @@
 """
 Build search index from IDFM real-time data perimeter CSV
 This ensures we only search stops that have real-time data available
+
+Usage:
+    python -m api.build_search_index [--csv PATH] [--output PATH] [--json PATH] [--force]
+
+The CSV is streamed and hashed: when the existing index was built from the
+same file the build is a no-op. The running app picks a new index file up
+by itself, so the build can be run inside the container
+(docker compose exec transit-dashboard python -m api.build_search_index).
 """
+import argparse
 import csv
+import hashlib
 import json
-from typing import List, Dict, Set
+import os
+import time
+from functools import lru_cache
+from typing import List, Dict, Optional, Set, Tuple
 from collections import defaultdict
 
+from .binary_index import MappedIndex, write_index_file
+from .fileio import atomic_write
+from .geo import parse_lambert93
+from .search_index import MODE_NAMES, build_term_index, compile_index, normalize_text
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../data')
+DEFAULT_CSV = os.path.join(DATA_DIR, 'perimetre-des-donnees-tr-disponibles-plateforme-idfm.csv')
+DEFAULT_OUTPUT = os.path.join(DATA_DIR, 'search_index.bin')
+
+# Lambert-93 coordinate columns, by order of preference (names vary between exports)
+X_COLUMNS = ("ns2_x", "x", "stop_x", "coord_x", "x_lambert93")
+Y_COLUMNS = ("ns2_y", "y", "stop_y", "coord_y", "y_lambert93")
+
+# Optional line details, not present in every export
+MODE_COLUMNS = ("mode", "transportmode", "ns2_vehiclemode")
+OPERATOR_COLUMNS = ("operatorname", "operator", "ns2_operatorref", "operateur")
+
+# Line to transport type mapping
+TRANSPORT_TYPES = {
+    "C01742": "rer",  # RER A
+    "C01743": "rer",  # RER B
+    "C01728": "rer",  # RER D
+    "C01727": "rer",  # RER C
+    "C01729": "rer",  # RER E
+    "C01371": "metro",  # Metro 1
+    "C01372": "metro",  # Metro 2
+    "C01373": "metro",  # Metro 3
+    "C01374": "metro",  # Metro 4
+    "C01375": "metro",  # Metro 5
+    "C01376": "metro",  # Metro 6
+    "C01377": "metro",  # Metro 7
+    "C01378": "metro",  # Metro 8
+    "C01379": "metro",  # Metro 9
+    "C01380": "metro",  # Metro 10
+    "C01381": "metro",  # Metro 11
+    "C01382": "metro",  # Metro 12
+    "C01383": "metro",  # Metro 13
+    "C01384": "metro",  # Metro 14
+}
+
+# One CSV row as used by the builder:
+# (line_id, line_name, stop_name, x, y, mode, operator)
+Row = Tuple[str, str, str, str, str, str, str]
+
+# The same names come back on thousands of rows
+_normalize = lru_cache(maxsize=65536)(normalize_text)
+
+
+def _find_column(fieldnames: List[str], candidates) -> Optional[str]:
+    """First candidate present among the CSV columns (case-insensitive), or None"""
+    by_lower = {name.strip().lower(): name for name in fieldnames or []}
+    for candidate in candidates:
+        if candidate in by_lower:
+            return by_lower[candidate]
+    return None
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_perimeter(csv_path: str) -> Dict[str, List[Row]]:
+    """Stream the perimeter CSV into the rows of each stop, in file order"""
+    rows_by_stop: Dict[str, List[Row]] = defaultdict(list)
+
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:  # utf-8-sig handles BOM
+        reader = csv.DictReader(f, delimiter=';')
+        x_column = _find_column(reader.fieldnames, X_COLUMNS)
+        y_column = _find_column(reader.fieldnames, Y_COLUMNS)
+        mode_column = _find_column(reader.fieldnames, MODE_COLUMNS)
+        operator_column = _find_column(reader.fieldnames, OPERATOR_COLUMNS)
+
+        def column(row: Dict[str, str], name: Optional[str]) -> str:
+            return (row.get(name) or "").strip() if name else ""
+
+        for row in reader:
+            rows_by_stop[row['ns2_stoppointref'].strip()].append((
+                row['line'].strip(),
+                row['name_line'].strip(),
+                row['ns2_stopname'].strip(),
+                column(row, x_column),
+                column(row, y_column),
+                column(row, mode_column),
+                column(row, operator_column),
+            ))
+
+    return rows_by_stop
+
+
+def transport_type_for(line_id: str, line_name: str) -> str:
+    """Transport type from the line id, or the line name for trams"""
+    line_code = line_id.replace('STIF:Line::', '').replace(':', '')
+    transport_type = TRANSPORT_TYPES.get(line_code, 'bus')
+
+    # Detect tram
+    if line_name.startswith('T') and line_name[1:].isdigit():
+        transport_type = 'tram'
+    return transport_type
+
+
+def build_stop(stop_id: str, rows: List[Row]) -> Tuple[Dict, List[str]]:
+    """Stop record and search terms from the rows of one stop"""
+    stop_name = rows[0][2]
+    stop = {
+        "id": stop_id,
+        "name": stop_name,
+        "lines": [],
+        "norm_name": _normalize(stop_name),
+    }
+    seen_lines: Set[Tuple[str, ...]] = set()
+    terms: Set[str] = set()
+
+    for line_id, line_name, row_stop_name, x, y, mode, operator in rows:
+        transport_type = transport_type_for(line_id, line_name)
+
+        # Location, from the first row with valid EPSG:2154 coordinates
+        if "location" not in stop and x and y:
+            location = parse_lambert93(x, y)
+            if location:
+                stop["location"] = {"lat": round(location[0], 6), "lon": round(location[1], 6)}
+
+        # Add line to stop (O(1) dedup)
+        line_info = {
+            "line_id": line_id,
+            "line_name": line_name,
+            "transport_type": transport_type,
+            "mode": mode or MODE_NAMES.get(transport_type, "Bus"),
+            "operator": operator
+        }
+        line_key = tuple(line_info.values())
+        if line_key not in seen_lines:
+            seen_lines.add(line_key)
+            stop["lines"].append(line_info)
+
+        # Build search terms (accent-folded, lowercase)
+        stop_name_normalized = _normalize(row_stop_name)
+
+        # Stop name
+        for term in stop_name_normalized.replace('-', ' ').split():
+            if len(term) > 2:  # Skip very short terms
+                terms.add(term)
+
+        # Full stop name
+        terms.add(stop_name_normalized)
+
+        # Line name
+        terms.add(_normalize(line_name))
+
+        # Combined: "rer a", "metro 1", etc.
+        terms.add(_normalize(f"{transport_type} {line_name}"))
+
+    return stop, sorted(terms)
+
 
 def parse_csv_to_search_index(csv_path: str) -> Dict:
     """
     Parse the IDFM real-time perimeter CSV into a searchable index
-    
+
     Returns:
         {
             "stops": {
@@ -22,126 +193,111 @@ def parse_csv_to_search_index(csv_path: str) -> Dict:
                         {
                             "line_id": "STIF:Line::C01742:",
                             "line_name": "A",
-                            "transport_type": "rer"
+                            "transport_type": "rer",
+                            "mode": "RapidTransit",
+                            "operator": "RATP"
                         }
                     ],
-                    "location": {"lat": 48.xxx, "lon": 2.xxx}
+                    "location": {"lat": 48.xxx, "lon": 2.xxx},   # WGS84, when known
+                    "norm_name": "joinville-le-pont"
                 }
             },
             "search_terms": {
                 "joinville": ["stop_id1", "stop_id2"],
                 "rer a": ["stop_id3"]
-            }
+            },
+            "terms": ["joinville", "rer a", ...],
+            "ngrams": {"joi": [0], "rer": [1], ...},
+            "prefixes": {"jo": [0], "re": [1], ...}
         }
+
+    Search terms are accent-folded; "ngrams" and "prefixes" map to positions in "terms".
+    Locations are converted from the Lambert-93 (EPSG:2154) coordinates of the CSV.
     """
-    
     stops = {}
-    lines_by_stop = defaultdict(list)
     search_terms = defaultdict(set)
-    
-    # Line to transport type mapping
-    transport_types = {
-        "C01742": "rer",  # RER A
-        "C01743": "rer",  # RER B
-        "C01728": "rer",  # RER D
-        "C01727": "rer",  # RER C
-        "C01729": "rer",  # RER E
-        "C01371": "metro",  # Metro 1
-        "C01372": "metro",  # Metro 2
-        "C01373": "metro",  # Metro 3
-        "C01374": "metro",  # Metro 4
-        "C01375": "metro",  # Metro 5
-        "C01376": "metro",  # Metro 6
-        "C01377": "metro",  # Metro 7
-        "C01378": "metro",  # Metro 8
-        "C01379": "metro",  # Metro 9
-        "C01380": "metro",  # Metro 10
-        "C01381": "metro",  # Metro 11
-        "C01382": "metro",  # Metro 12
-        "C01383": "metro",  # Metro 13
-        "C01384": "metro",  # Metro 14
-    }
-    
-    with open(csv_path, 'r', encoding='utf-8-sig') as f:  # utf-8-sig handles BOM
-        reader = csv.DictReader(f, delimiter=';')
-        
-        for row in reader:
-            line_id = row['line'].strip()
-            line_name = row['name_line'].strip()
-            stop_id = row['ns2_stoppointref'].strip()
-            stop_name = row['ns2_stopname'].strip()
-            
-            # Determine transport type
-            line_code = line_id.replace('STIF:Line::', '').replace(':', '')
-            transport_type = transport_types.get(line_code, 'bus')
-            
-            # Detect tram
-            if line_name.startswith('T') and line_name[1:].isdigit():
-                transport_type = 'tram'
-            
-            # Parse location (from EPSG:2154 coordinates)
-            # For now, skip location conversion - we'll use it later if needed
-            
-            # Add to stops
-            if stop_id not in stops:
-                stops[stop_id] = {
-                    "id": stop_id,
-                    "name": stop_name,
-                    "lines": []
-                }
-            
-            # Add line to stop
-            line_info = {
-                "line_id": line_id,
-                "line_name": line_name,
-                "transport_type": transport_type
-            }
-            
-            if line_info not in stops[stop_id]["lines"]:
-                stops[stop_id]["lines"].append(line_info)
-            
-            # Build search terms
-            # Stop name
-            stop_terms = stop_name.lower().replace('-', ' ').split()
-            for term in stop_terms:
-                if len(term) > 2:  # Skip very short terms
-                    search_terms[term].add(stop_id)
-            
-            # Full stop name
-            search_terms[stop_name.lower()].add(stop_id)
-            
-            # Line name
-            search_terms[line_name.lower()].add(stop_id)
-            
-            # Combined: "rer a", "metro 1", etc.
-            search_terms[f"{transport_type} {line_name}".lower()].add(stop_id)
-    
+
+    for stop_id, rows in read_perimeter(csv_path).items():
+        stop, terms = build_stop(stop_id, rows)
+        stops[stop_id] = stop
+        for term in terms:
+            search_terms[term].add(stop_id)
+
     # Convert sets to lists for JSON serialization
-    search_terms_lists = {k: list(v) for k, v in search_terms.items()}
-    
+    search_terms_lists = {k: sorted(v) for k, v in search_terms.items()}
+
     return {
         "stops": stops,
-        "search_terms": search_terms_lists
+        "search_terms": search_terms_lists,
+        **build_term_index(search_terms_lists),
     }
 
 
-def build_index():
-    """Build and save the search index"""
-    csv_path = "/mnt/user-data/uploads/perimetre-des-donnees-tr-disponibles-plateforme-idfm.csv"
-    output_path = "/home/claude/transit-dashboard-v3-docker/data/search_index.json"
-    
-    print("Building search index from real-time data CSV...")
+def write_binary_index(index: Dict, output_path: str, meta: Optional[Dict] = None):
+    """Write the index in the compact, memory-mappable format (see binary_index)"""
+    write_index_file(output_path, compile_index(index), meta={
+        "stops": len(index["stops"]),
+        "located_stops": sum(1 for stop in index["stops"].values() if "location" in stop),
+        "terms": len(index["terms"]),
+        **(meta or {}),
+    })
+
+
+def _write_json(path: str, data: Dict, **kwargs):
+    """Write JSON atomically"""
+    with atomic_write(path) as f:
+        # dumps uses the C encoder, dump streams through the pure-Python one
+        f.write(json.dumps(data, ensure_ascii=False, **kwargs))
+
+
+def indexed_source_hash(output_path: str) -> Optional[str]:
+    """SHA-256 of the CSV an existing index file was built from, if known"""
+    try:
+        return MappedIndex(output_path).meta.get("source_sha256")
+    except (OSError, ValueError):
+        return None
+
+
+def build_index(csv_path: str = DEFAULT_CSV, output_path: str = DEFAULT_OUTPUT,
+                json_path: Optional[str] = None, force: bool = False) -> Dict:
+    """Build and save the search index, unless built from the same CSV already; returns a summary"""
+    started = time.perf_counter()
+    source_hash = file_hash(csv_path)
+
+    if not force and indexed_source_hash(output_path) == source_hash:
+        print(f"Search index is up to date ({output_path})")
+        return {"changed": False, "source_sha256": source_hash}
+
+    print(f"Building search index from {csv_path}...")
     index = parse_csv_to_search_index(csv_path)
-    
+
     print(f"Indexed {len(index['stops'])} stops")
     print(f"Created {len(index['search_terms'])} search terms")
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(index, f, ensure_ascii=False, indent=2)
-    
-    print(f"Search index saved to {output_path}")
-    return index
+
+    write_binary_index(index, output_path, meta={"source_sha256": source_hash})
+    if json_path:
+        _write_json(json_path, index, indent=2)
+
+    elapsed = time.perf_counter() - started
+    print(f"Search index saved to {output_path} in {elapsed:.2f}s")
+    return {
+        "changed": True,
+        "source_sha256": source_hash,
+        "stops": len(index["stops"]),
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build the stop search index from the IDFM perimeter CSV")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="perimeter CSV (default: %(default)s)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="binary index file (default: %(default)s)")
+    parser.add_argument("--json", dest="json_path", help="also write the JSON form of the index")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the CSV is unchanged")
+    args = parser.parse_args(argv)
+
+    build_index(args.csv, args.output, args.json_path, args.force)
 
 
 if __name__ == "__main__":
-    build_index()
+    main()
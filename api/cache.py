@@ -0,0 +1,203 @@
+"""
+Async TTL + LRU cache for remote lookups
+Results of slow, idempotent client calls (address search, lines at a stop,
+...) are kept for a per-method TTL in a size-bounded LRU. Concurrent
+identical calls share one in-flight request, and the entries can be saved
+to disk so the cache survives restarts.
+"""
+import asyncio
+import functools
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .fileio import atomic_write
+from .log import get_logger
+
+logger = get_logger("cache")
+
+# All caches created with @cached, by name
+CACHES: Dict[str, "AsyncTTLCache"] = {}
+
+
+class AsyncTTLCache:
+    """
+    Mapping of call keys to results, evicting expired entries lazily and the
+    least recently used one when full
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 256):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        # key -> (expiry as a wall-clock timestamp, value)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """(found, value) for a fresh entry"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry[1]
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        """Like get(), counted in the hit/miss stats"""
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found, value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        self._entries.clear()
+
+    async def get_or_load(self, key: str, load: Callable[[], Awaitable[Any]],
+                          store: Callable[[Any], bool] = lambda value: True) -> Any:
+        """
+        Cached value for key, or the result of load(). Callers asking for a
+        key that is already loading wait for that load instead of starting
+        their own. The load runs in its own task, so cancelling one caller
+        neither cancels it nor the other callers. Results rejected by
+        store() are returned but not kept.
+        """
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, load, store))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._load_done(key, done))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str, load: Callable[[], Awaitable[Any]], store: Callable[[Any], bool]) -> Any:
+        value = await load()
+        if store(value):
+            self.set(key, value)
+        return value
+
+    def _load_done(self, key: str, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Consumed here so an error nobody waited for isn't logged
+        if not task.cancelled():
+            task.exception()
+
+    # ==================== DISK STORE ====================
+
+    def dump(self) -> Dict[str, Any]:
+        now = time.time()
+        return {key: [expiry, value] for key, (expiry, value) in self._entries.items() if expiry > now}
+
+    def restore(self, entries: Dict[str, Any]):
+        now = time.time()
+        for key, (expiry, value) in entries.items():
+            if expiry > now:
+                self._entries[key] = (expiry, value)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
+
+
+def _call_key(args: tuple, kwargs: dict) -> str:
+    return json.dumps([args, sorted(kwargs.items())], default=str, ensure_ascii=False)
+
+
+def cached(name: str, ttl: float, maxsize: int = 256,
+           key: Optional[Callable[..., Any]] = None, cache_empty: bool = False):
+    """
+    Cache the results of an async method in the shared cache `name`.
+    `key` maps the call arguments (without self) to the cache key. Empty
+    results are not kept unless cache_empty, since the client methods
+    return them on errors too.
+    """
+    cache = CACHES.setdefault(name, AsyncTTLCache(name, ttl, maxsize))
+
+    def call_key(*args, **kwargs) -> str:
+        """Cache key of a call (arguments without self)"""
+        return _call_key((key(*args, **kwargs),) if key else args, {} if key else kwargs)
+
+    def decorator(method: Callable[..., Awaitable[Any]]):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            return await cache.get_or_load(
+                call_key(*args, **kwargs),
+                lambda: method(self, *args, **kwargs),
+                store=(lambda value: True) if cache_empty else bool,
+            )
+        wrapper.cache = cache
+        wrapper.cache_key = call_key
+        return wrapper
+
+    return decorator
+
+
+def configure_caches(ttls: Optional[Dict[str, float]] = None, maxsize: Optional[Dict[str, int]] = None):
+    """Override the default TTLs (seconds) and sizes, by cache name"""
+    for name, ttl in (ttls or {}).items():
+        if name in CACHES:
+            CACHES[name].ttl = float(ttl)
+    for name, size in (maxsize or {}).items():
+        if name in CACHES:
+            CACHES[name].maxsize = int(size)
+
+
+def load_caches(path: str):
+    """Restore cache entries saved by save_caches"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load cache file %s: %s", path, e)
+        return
+    for name, entries in saved.items():
+        if name in CACHES:
+            CACHES[name].restore(entries)
+    logger.info("Restored %d cached entries from %s", sum(len(c) for c in CACHES.values()), path)
+
+
+def save_caches(path: str):
+    """Write the fresh entries of all caches to path, atomically"""
+    try:
+        with atomic_write(path) as f:
+            f.write(json.dumps({name: cache.dump() for name, cache in CACHES.items()}, ensure_ascii=False))
+    except OSError as e:
+        logger.warning("Could not save cache file %s: %s", path, e)
@@ -1,36 +1,193 @@
 import httpx
-import os
-import unicodedata
+import importlib.util
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any, Tuple
-from .models import Departure, StopDepartures, StopConfig, SearchResult
-import pytz
-import json
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
+from .models import StopDepartures, StopConfig, SearchResult
+from .log import get_logger
+from .metrics import PRIM_REQUEST_SECONDS, PARSE_SECONDS
+from .cache import cached
+from .fileio import atomic_write
+from .geo import within_radius
+from .search_index import SearchIndex, get_search_index
+from .search_rank import rank_stops
+from .siri import (PARIS_TZ, DepartureSelection, VisitScanner, decode_visits, extract_line_name, loads,
+                   monitored_visits)
 import asyncio
+import hashlib
+import json
 import re
-import math
+import time
 
-# Paris timezone
-PARIS_TZ = pytz.timezone('Europe/Paris')
+logger = get_logger("client")
 
 # API endpoints
 PRIM_BASE_URL = "https://prim.iledefrance-mobilites.fr/marketplace"
 OPENDATA_URL = "https://data.iledefrance-mobilites.fr/api/explore/v2.1/catalog/datasets"
 ADDRESS_API_URL = "https://api-adresse.data.gouv.fr"
 
+# Maximum number of stop search results
+SEARCH_LIMIT = 30
+
+# Open Data records per page, and the furthest a query can be paged
+OPENDATA_PAGE_SIZE = 100
+OPENDATA_MAX_RECORDS = 10000
+
+# Stops per Open Data query in get_lines_at_stops
+LINES_BATCH_CHUNK = 20
 
-def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calculate distance between two points in meters"""
-    R = 6371000  # Earth's radius in meters
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    
-    a = math.sin(delta_phi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
+# HTTP/2 needs the optional "h2" package (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Default connection pool limits, per host
+DEFAULT_HTTP_LIMITS = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60,
+}
+
+
+class RateLimitError(Exception):
+    """Raised when a PRIM request would exceed the API key quota"""
+
+
+class RateBudget:
+    """
+    Request budget for a PRIM API key:
+    - token bucket for the per-second quota
+    - counter for the daily quota (reset at midnight, Paris time)
+    - backoff after 429 responses, honouring Retry-After
+    """
+    
+    MAX_BACKOFF_SECONDS = 300
+    
+    def __init__(self, daily_limit: int = 20000, per_second: float = 5):
+        self.daily_limit = daily_limit
+        self.per_second = per_second
+        self._tokens = float(per_second)
+        self._last_refill = time.monotonic()
+        self._day = datetime.now(PARIS_TZ).date()
+        self._used_today = 0
+        self._blocked_until = 0.0
+        self._consecutive_429 = 0
+        self._throttled = 0
+    
+    def _roll_day(self):
+        today = datetime.now(PARIS_TZ).date()
+        if today != self._day:
+            self._day = today
+            self._used_today = 0
+    
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.per_second, self._tokens + (now - self._last_refill) * self.per_second)
+        self._last_refill = now
+    
+    @property
+    def remaining_today(self) -> int:
+        self._roll_day()
+        return max(0, self.daily_limit - self._used_today)
+    
+    def blocked_for(self) -> float:
+        """Seconds left before requests are allowed again after a 429"""
+        return max(0.0, self._blocked_until - time.monotonic())
+    
+    async def acquire(self):
+        """Take one request from the budget, waiting for the per-second bucket if needed"""
+        if self.blocked_for() > 0:
+            raise RateLimitError(f"API rate limit exceeded, retry in {self.blocked_for():.0f}s")
+        if self.remaining_today <= 0:
+            raise RateLimitError("API daily quota exhausted")
+        
+        self._refill()
+        while self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.per_second)
+            self._refill()
+        self._tokens -= 1
+        self._used_today += 1
+    
+    def record_response(self, status_code: int, retry_after: Optional[str] = None):
+        """Update backoff state from a PRIM response"""
+        if status_code != 429:
+            self._consecutive_429 = 0
+            return
+        
+        self._consecutive_429 += 1
+        self._throttled += 1
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = 2 ** self._consecutive_429
+        delay = min(delay, self.MAX_BACKOFF_SECONDS)
+        self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+    
+    def effective_interval(self, requests_per_cycle: int, base_interval: float) -> float:
+        """
+        Refresh interval that spreads the remaining daily budget evenly until midnight.
+        Never shorter than the configured interval.
+        """
+        if requests_per_cycle <= 0:
+            return base_interval
+        
+        now = datetime.now(PARIS_TZ)
+        midnight = PARIS_TZ.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+        seconds_left = max(1.0, (midnight - now).total_seconds())
+        
+        remaining = self.remaining_today
+        if remaining <= 0:
+            return max(base_interval, seconds_left)
+        
+        budget_interval = requests_per_cycle * seconds_left / remaining
+        per_second_interval = requests_per_cycle / self.per_second
+        return max(base_interval, budget_interval, per_second_interval)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Budget state for health reporting"""
+        return {
+            "daily_limit": self.daily_limit,
+            "used_today": self._used_today,
+            "remaining_today": self.remaining_today,
+            "per_second": self.per_second,
+            "blocked_for_seconds": round(self.blocked_for(), 1),
+            "throttled_responses": self._throttled,
+        }
+    
+    def dump(self) -> Dict[str, Any]:
+        """Daily usage, to be restored after a restart"""
+        self._roll_day()
+        return {"day": self._day.isoformat(), "used_today": self._used_today}
+    
+    def restore(self, state: Dict[str, Any]):
+        """Count requests already made today by a previous process (see dump)"""
+        self._roll_day()
+        if state.get("day") == self._day.isoformat():
+            self._used_today = max(self._used_today, int(state.get("used_today", 0)))
+
+
+def rate_budget_id(api_key: str) -> str:
+    """Identifies an API key in the budget file without storing the key itself"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def load_rate_budgets(path: str) -> Dict[str, Dict[str, Any]]:
+    """Read the daily usage saved by save_rate_budgets, by budget id"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Could not load rate budget file %s: %s", path, e)
+        return {}
+
+
+def save_rate_budgets(path: str, budgets: Dict[str, RateBudget]):
+    """Write the daily usage of each API key's budget to path, atomically"""
+    try:
+        with atomic_write(path) as f:
+            json.dump({key_id: budget.dump() for key_id, budget in budgets.items()}, f)
+    except OSError as e:
+        logger.warning("Could not save rate budget file %s: %s", path, e)
 
 
 class IDFMClient:
@@ -41,42 +198,94 @@ class IDFMClient:
     - French Address API (no auth): Geocoding addresses
     """
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, http_limits: Optional[Dict[str, Any]] = None, http2: bool = True,
+                 rate_budget: Optional[RateBudget] = None, stream_departures: bool = True):
         self.api_key = api_key
+        # Decode StopMonitoring responses while they download instead of as a whole
+        self.stream_departures = stream_departures
+        self.rate_budget = rate_budget or RateBudget()
         self.prim_headers = {
             "apikey": api_key,
             "Accept": "application/json"
         }
-        # Load local search index
-        self._search_index = self._load_search_index()
+        # Long-lived connection pools, one per API host
+        limits = {**DEFAULT_HTTP_LIMITS, **(http_limits or {})}
+        self._limits = httpx.Limits(**limits)
+        self._http2 = http2 and HTTP2_AVAILABLE
+        self._pools: Dict[str, httpx.AsyncClient] = {}
     
-    def _load_search_index(self) -> Dict:
-        """Load pre-built search index from JSON"""
-        try:
-            index_path = os.path.join(os.path.dirname(__file__), '../data/search_index.json')
-            with open(index_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Warning: Could not load search index: {e}")
-            return {"stops": {}, "search_terms": {}}
-        self._cache_time: Optional[datetime] = None
+    @property
+    def _search_index(self) -> SearchIndex:
+        """Process-wide search index, shared by all clients"""
+        return get_search_index()
     
-    def _get_paris_time(self) -> datetime:
-        return datetime.now(PARIS_TZ)
+    # ==================== CONNECTION POOLS ====================
+    
+    def _http(self, base_url: str) -> httpx.AsyncClient:
+        """Get the pooled HTTP client for an API host, creating it on first use"""
+        client = self._pools.get(base_url)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=15,
+                limits=self._limits,
+                http2=self._http2
+            )
+            self._pools[base_url] = client
+        return client
+    
+    async def open(self):
+        """Open connection pools for all API hosts ahead of the first request"""
+        for base_url in (PRIM_BASE_URL, OPENDATA_URL, ADDRESS_API_URL):
+            self._http(base_url)
+    
+    async def aclose(self):
+        """Close all connection pools"""
+        pools = list(self._pools.values())
+        self._pools.clear()
+        for client in pools:
+            await client.aclose()
+    
+    async def _prim_get(self, path: str, params: Dict[str, str], timeout: Optional[float] = None) -> httpx.Response:
+        """GET a PRIM endpoint, charging the request to the API key budget"""
+        return await self._prim_send(path, params, timeout)
     
-    def _parse_idfm_time(self, time_str: str) -> datetime:
-        if not time_str:
-            return self._get_paris_time()
+    @asynccontextmanager
+    async def _prim_stream(self, path: str, params: Dict[str, str],
+                           timeout: Optional[float] = None) -> AsyncIterator[httpx.Response]:
+        """Like _prim_get, but the body is left unread to be iterated in chunks"""
+        response = await self._prim_send(path, params, timeout, stream=True)
         try:
-            if '.' in time_str:
-                time_str = time_str.split('.')[0] + 'Z'
-            dt = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
-            return dt.astimezone(PARIS_TZ)
+            yield response
+        finally:
+            await response.aclose()
+    
+    async def _prim_send(self, path: str, params: Dict[str, str], timeout: Optional[float] = None,
+                         stream: bool = False) -> httpx.Response:
+        await self.rate_budget.acquire()
+        client = self._http(PRIM_BASE_URL)
+        kwargs = {"timeout": timeout} if timeout else {}
+        request = client.build_request("GET", f"{PRIM_BASE_URL}/{path}", headers=self.prim_headers,
+                                       params=params, **kwargs)
+        started = time.perf_counter()
+        try:
+            # When streaming, the duration only covers the response headers
+            response = await client.send(request, stream=stream)
+        except httpx.TimeoutException:
+            PRIM_REQUEST_SECONDS.observe(time.perf_counter() - started, status="timeout")
+            raise
         except Exception:
-            return self._get_paris_time()
+            PRIM_REQUEST_SECONDS.observe(time.perf_counter() - started, status="error")
+            raise
+        PRIM_REQUEST_SECONDS.observe(time.perf_counter() - started, status=response.status_code)
+        self.rate_budget.record_response(response.status_code, response.headers.get("Retry-After"))
+        return response
+    
+    def _get_paris_time(self) -> datetime:
+        return datetime.now(PARIS_TZ)
     
     # ==================== ADDRESS SEARCH ====================
     
+    @cached("search_address", ttl=86400, maxsize=512, key=lambda query: query.strip().lower())
     async def search_address(self, query: str) -> List[Dict[str, Any]]:
         """
         Search for addresses using French government API
@@ -85,187 +294,302 @@ class IDFMClient:
         results = []
         
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                url = f"{ADDRESS_API_URL}/search/"
-                params = {
-                    "q": query,
-                    "limit": 10,
-                    "autocomplete": 1
-                }
-                
-                response = await client.get(url, params=params)
+            client = self._http(ADDRESS_API_URL)
+            url = f"{ADDRESS_API_URL}/search/"
+            params = {
+                "q": query,
+                "limit": 10,
+                "autocomplete": 1
+            }
+            
+            response = await client.get(url, params=params, timeout=10)
+            
+            if response.status_code == 200:
+                data = response.json()
+                features = data.get("features", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    features = data.get("features", [])
+                for feature in features:
+                    props = feature.get("properties", {})
+                    geom = feature.get("geometry", {})
+                    coords = geom.get("coordinates", [0, 0])
                     
-                    for feature in features:
-                        props = feature.get("properties", {})
-                        geom = feature.get("geometry", {})
-                        coords = geom.get("coordinates", [0, 0])
-                        
-                        # Filter to Île-de-France region
-                        context = props.get("context", "")
-                        if not any(dept in context for dept in ["75", "77", "78", "91", "92", "93", "94", "95", "Île-de-France"]):
-                            continue
-                        
-                        results.append({
-                            "label": props.get("label", ""),
-                            "city": props.get("city", ""),
-                            "postcode": props.get("postcode", ""),
-                            "lon": coords[0],
-                            "lat": coords[1],
-                            "type": props.get("type", "")
-                        })
+                    # Filter to Île-de-France region
+                    context = props.get("context", "")
+                    if not any(dept in context for dept in ["75", "77", "78", "91", "92", "93", "94", "95", "Île-de-France"]):
+                        continue
+                    
+                    results.append({
+                        "label": props.get("label", ""),
+                        "city": props.get("city", ""),
+                        "postcode": props.get("postcode", ""),
+                        "lon": coords[0],
+                        "lat": coords[1],
+                        "type": props.get("type", "")
+                    })
         except Exception as e:
-            print(f"Address search error: {e}")
+            logger.warning("Address search error: %s", e)
         
         return results
     
     async def find_stops_near(self, lat: float, lon: float, radius_m: int = 500) -> List[Dict[str, Any]]:
         """
         Find all stops within radius meters of given coordinates
-        Uses multiple strategies with fallbacks for reliability
+        Answered from the local index when it has stop locations (even with
+        no stop in range), otherwise with multiple remote strategies
         """
+        stops = self._find_stops_near_local(lat, lon, radius_m)
+        if stops is not None:
+            return stops
         stops = []
         
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                url = f"{OPENDATA_URL}/arrets-lignes/records"
+            client = self._http(OPENDATA_URL)
+            url = f"{OPENDATA_URL}/arrets-lignes/records"
+            
+            # Strategy 1: Try geo distance query (fast when it works)
+            try:
+                params = {
+                    "where": f"distance(pointgeo, geom'POINT({lon} {lat})', {radius_m}m)",
+                    "limit": 100,
+                    "select": "stop_id,stop_name,stop_lat,stop_lon,nom_commune"
+                }
                 
-                # Strategy 1: Try geo distance query (fast when it works)
-                try:
-                    params = {
-                        "where": f"distance(pointgeo, geom'POINT({lon} {lat})', {radius_m}m)",
-                        "limit": 100,
-                        "select": "stop_id,stop_name,stop_lat,stop_lon,nom_commune"
-                    }
-                    
-                    response = await client.get(url, params=params, timeout=8)
+                response = await client.get(url, params=params, timeout=8)
+                
+                if response.status_code == 200:
+                    data = response.json()
+                    records = data.get("results", [])
                     
-                    if response.status_code == 200:
-                        data = response.json()
-                        records = data.get("results", [])
-                        
-                        if len(records) > 0:
-                            # Success! Process results
-                            all_records = records
-                        else:
-                            # No results, try fallback
-                            raise Exception("No results from geo query")
+                    if len(records) > 0:
+                        # Success! Process results
+                        all_records = records
                     else:
-                        raise Exception(f"Geo query failed: {response.status_code}")
-                        
-                except Exception as e:
-                    # Strategy 2: Fallback to wider area search
-                    print(f"Geo query failed, using fallback: {e}")
-                    
-                    # Get larger dataset and filter in Python
-                    params = {
-                        "limit": 1000,
-                        "select": "stop_id,stop_name,stop_lat,stop_lon,nom_commune"
-                    }
-                    
-                    response = await client.get(url, params=params, timeout=10)
+                        # No results, try fallback
+                        raise Exception("No results from geo query")
+                else:
+                    raise Exception(f"Geo query failed: {response.status_code}")
                     
-                    if response.status_code == 200:
-                        data = response.json()
-                        all_records = data.get("results", [])
-                    else:
-                        return []
+            except Exception as e:
+                # Strategy 2: Fallback to wider area search
+                logger.info("Geo query failed, using fallback: %s", e)
                 
-                # Process records: deduplicate and calculate distances
-                seen_stops = {}
-                for record in all_records:
-                    stop_id = record.get("stop_id", "")
-                    if not stop_id or stop_id in seen_stops:
-                        continue
-                    
-                    # Parse coordinates
-                    try:
-                        stop_lat = float(record.get("stop_lat", 0))
-                        stop_lon = float(record.get("stop_lon", 0))
-                    except (ValueError, TypeError):
-                        continue
-                    
-                    if not stop_lat or not stop_lon:
-                        continue
-                    
-                    # Calculate distance
-                    distance = haversine_distance(lat, lon, stop_lat, stop_lon)
-                    
-                    # Only include stops within radius
-                    if distance <= radius_m:
-                        seen_stops[stop_id] = {
-                            "stop_id": self._convert_stop_id(stop_id),
-                            "stop_id_raw": stop_id,
-                            "stop_name": record.get("stop_name", ""),
-                            "distance": int(distance),
-                            "lat": stop_lat,
-                            "lon": stop_lon,
-                            "town": record.get("nom_commune", "")
-                        }
+                # Get larger dataset and filter in Python
+                params = {
+                    "limit": 1000,
+                    "select": "stop_id,stop_name,stop_lat,stop_lon,nom_commune"
+                }
                 
-                # Sort by distance
-                stops = sorted(seen_stops.values(), key=lambda x: x["distance"])
-        
+                response = await client.get(url, params=params, timeout=10)
+                
+                if response.status_code == 200:
+                    data = response.json()
+                    all_records = data.get("results", [])
+                else:
+                    return []
+            
+            # Deduplicate records with valid coordinates
+            unique = {}
+            for record in all_records:
+                stop_id = record.get("stop_id", "")
+                if not stop_id or stop_id in unique:
+                    continue
+                
+                # Parse coordinates
+                try:
+                    stop_lat = float(record.get("stop_lat", 0))
+                    stop_lon = float(record.get("stop_lon", 0))
+                except (ValueError, TypeError):
+                    continue
+                
+                if not stop_lat or not stop_lon:
+                    continue
+                unique[stop_id] = (record, stop_lat, stop_lon)
+            
+            # Distances of all the records in one pass, nearest first
+            candidates = list(unique.items())
+            lats = [c[1][1] for c in candidates]
+            lons = [c[1][2] for c in candidates]
+            for distance, i in within_radius(lat, lon, lats, lons, radius_m)[:20]:
+                stop_id, (record, stop_lat, stop_lon) = candidates[i]
+                stops.append({
+                    "stop_id": self._convert_stop_id(stop_id),
+                    "stop_id_raw": stop_id,
+                    "stop_name": record.get("stop_name", ""),
+                    "distance": int(distance),
+                    "lat": stop_lat,
+                    "lon": stop_lon,
+                    "town": record.get("nom_commune", "")
+                })
+
         except Exception as e:
-            print(f"Find stops near error: {e}")
+            logger.warning("Find stops near error: %s", e)
         
         return stops[:20]
     
+    def _find_stops_near_local(self, lat: float, lon: float, radius_m: int) -> Optional[List[Dict[str, Any]]]:
+        """Nearby stops from the local index (real-time perimeter only), None if it has no locations"""
+        index = self._search_index
+        if not index.has_locations:
+            return None
+        
+        stops = []
+        for distance, stop_pos in index.stops_near(lat, lon, radius_m)[:20]:
+            stop_id = index.strings[index.stop_id[stop_pos]]
+            stops.append({
+                "stop_id": stop_id,
+                "stop_id_raw": self._raw_stop_id(stop_id),
+                "stop_name": index.strings[index.stop_name[stop_pos]],
+                "distance": int(distance),
+                "lat": index.stop_lat[stop_pos],
+                "lon": index.stop_lon[stop_pos],
+                "town": ""  # Town info not in perimeter CSV
+            })
+        return stops
+    
+    def _lines_at_stop_local(self, stop_id_raw: str) -> List[Dict[str, Any]]:
+        """Lines at a stop from the local catalogue (real-time perimeter only)"""
+        index = self._search_index
+        if not index.has_catalogue:
+            return []
+        stop_pos = index.stop_index(self._convert_stop_id(stop_id_raw))
+        if stop_pos < 0:
+            return []
+        
+        lines = []
+        seen = set()
+        for line_pos in index.stop_line_positions(stop_pos):
+            line = index.line(line_pos)
+            if line["line_name"] in seen:
+                continue
+            seen.add(line["line_name"])
+            lines.append(line)
+        return lines
+    
+    @cached("lines_at_stop", ttl=21600, maxsize=1024)
     async def get_lines_at_stop(self, stop_id_raw: str) -> List[Dict[str, Any]]:
         """
         Get all lines that serve a specific stop
         Uses the raw IDFM stop_id (e.g., IDFM:25805)
+        Answered from the local line catalogue, or Open Data for stops outside it
         """
-        lines = []
+        lines = self._lines_at_stop_local(stop_id_raw)
+        if lines:
+            return lines
         
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                url = f"{OPENDATA_URL}/arrets-lignes/records"
-                params = {
-                    "where": f"stop_id = '{stop_id_raw}'",
-                    "limit": 50,
-                    "select": "id,shortname,route_long_name,mode,operatorname"
-                }
-                
-                response = await client.get(url, params=params)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    records = data.get("results", [])
-                    
-                    seen = set()
-                    for record in records:
-                        line_id_raw = record.get("id", "")
-                        line_name = record.get("shortname") or record.get("route_long_name", "")
-                        
-                        if line_name in seen:
-                            continue
-                        seen.add(line_name)
-                        
-                        lines.append({
-                            "line_id": self._convert_line_id_from_opendata(line_id_raw),
-                            "line_name": line_name,
-                            "mode": record.get("mode", "Bus"),
-                            "transport_type": self._mode_name_to_transport(record.get("mode", "Bus")),
-                            "operator": record.get("operatorname", "")
-                        })
+            client = self._http(OPENDATA_URL)
+            url = f"{OPENDATA_URL}/arrets-lignes/records"
+            params = {
+                "where": f"stop_id = '{stop_id_raw}'",
+                "limit": 50,
+                "select": "id,shortname,route_long_name,mode,operatorname"
+            }
+            
+            response = await client.get(url, params=params)
+            
+            if response.status_code == 200:
+                data = response.json()
+                lines = self._lines_from_records(data.get("results", []))
         except Exception as e:
-            print(f"Get lines at stop error: {e}")
+            logger.warning("Get lines at stop error: %s", e)
         
         return lines
     
-    # ==================== STOP SEARCH (legacy) ====================
+    async def get_lines_at_stops(self, stop_ids_raw: List[str]) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, str]]:
+        """
+        Lines serving each of several stops (raw IDFM stop_ids), resolved in one pass:
+        from the lines cache and the local line catalogue, then Open Data for the rest.
+        Returns (lines by stop, error by stop); stops whose lines could not all be
+        fetched are left out of both, so they can be asked again.
+        """
+        cache = self.get_lines_at_stop.cache
+        cache_key = self.get_lines_at_stop.cache_key
+        results = {}
+        errors = {}
+        missing = []
+        for stop_id_raw in dict.fromkeys(stop_ids_raw):
+            # Ids end up in the query string, quotes would break it
+            if "'" in stop_id_raw:
+                errors[stop_id_raw] = "Identifiant d'arrêt invalide"
+                continue
+            found, lines = cache.lookup(cache_key(stop_id_raw))
+            if not found:
+                lines = self._lines_at_stop_local(stop_id_raw)
+                if lines:
+                    cache.set(cache_key(stop_id_raw), lines)
+            if lines:
+                results[stop_id_raw] = lines
+            else:
+                missing.append(stop_id_raw)
+        
+        chunks = [missing[i:i + LINES_BATCH_CHUNK] for i in range(0, len(missing), LINES_BATCH_CHUNK)]
+        for fetched in await asyncio.gather(*(self._fetch_lines_at_stops(chunk) for chunk in chunks)):
+            for stop_id_raw, lines in fetched.items():
+                results[stop_id_raw] = lines
+                if lines:
+                    cache.set(cache_key(stop_id_raw), lines)
+        
+        return results, errors
     
-    def _normalize_text(self, text: str) -> str:
-        """Remove accents and normalize text for search"""
-        # Normalize to NFD (decompose accents)
-        nfd = unicodedata.normalize('NFD', text)
-        # Remove accent marks (category Mn = Mark, Nonspacing)
-        without_accents = ''.join(c for c in nfd if unicodedata.category(c) != 'Mn')
-        return without_accents.lower().strip()
+    async def _fetch_lines_at_stops(self, stop_ids_raw: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Lines of a few stops from Open Data, paging through all records; {} on failure"""
+        client = self._http(OPENDATA_URL)
+        url = f"{OPENDATA_URL}/arrets-lignes/records"
+        ids = ", ".join(f"'{stop_id}'" for stop_id in stop_ids_raw)
+        params = {
+            "where": f"stop_id IN ({ids})",
+            "limit": OPENDATA_PAGE_SIZE,
+            "select": "stop_id,id,shortname,route_long_name,mode,operatorname"
+        }
+        
+        records = []
+        try:
+            while True:
+                response = await client.get(url, params={**params, "offset": len(records)})
+                if response.status_code != 200:
+                    logger.warning("Get lines at stops error: HTTP %d", response.status_code)
+                    return {}
+                data = response.json()
+                page = data.get("results", [])
+                records.extend(page)
+                total = data.get("total_count", 0)
+                if len(records) >= total:
+                    break
+                if not page or len(records) + OPENDATA_PAGE_SIZE > OPENDATA_MAX_RECORDS:
+                    logger.warning("Get lines at stops: only %d/%d records available", len(records), total)
+                    return {}
+        except Exception as e:
+            logger.warning("Get lines at stops error: %s", e)
+            return {}
+        
+        by_stop: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            by_stop.setdefault(record.get("stop_id", ""), []).append(record)
+        return {stop_id_raw: self._lines_from_records(by_stop.get(stop_id_raw, []))
+                for stop_id_raw in stop_ids_raw}
+    
+    def _lines_from_records(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Lines from arrets-lignes records, one per line name"""
+        lines = []
+        seen = set()
+        for record in records:
+            line_id_raw = record.get("id", "")
+            line_name = record.get("shortname") or record.get("route_long_name", "")
+            
+            if line_name in seen:
+                continue
+            seen.add(line_name)
+            
+            lines.append({
+                "line_id": self._convert_line_id_from_opendata(line_id_raw),
+                "line_name": line_name,
+                "mode": record.get("mode", "Bus"),
+                "transport_type": self._mode_name_to_transport(record.get("mode", "Bus")),
+                "operator": record.get("operatorname", "")
+            })
+        return lines
+    
+    # ==================== STOP SEARCH (legacy) ====================
     
     async def search_stops(self, query: str, transport_type: str = None) -> List[SearchResult]:
         """Search stops using local index (built from real-time data perimeter)"""
@@ -275,36 +599,25 @@ class IDFMClient:
             if not query or len(query) < 2:
                 return results
             
-            # Check if search index is loaded
-            if not self._search_index or not self._search_index.get("search_terms"):
-                print("[SEARCH] Warning: Search index not loaded")
+            # Same index for the whole search, even if a reload swaps it meanwhile
+            index = self._search_index
+            if not index:
+                logger.warning("Search index not loaded")
                 return results
             
-            # Normalize query for accent-insensitive search
-            query_normalized = self._normalize_text(query)
-            matched_stops = set()
-            
-            # Search through index terms (normalized comparison)
-            for term, stop_ids in self._search_index["search_terms"].items():
-                if not isinstance(term, str):
-                    continue
-                term_normalized = self._normalize_text(term)
-                if query_normalized in term_normalized:
-                    matched_stops.update(stop_ids)
+            # Best stops first; only those are turned into results
+            ranked = rank_stops(index, query, limit=SEARCH_LIMIT,
+                                transport_type=transport_type)
         
         except Exception as e:
-            print(f"[SEARCH] Error in search: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error in search: %s", e)
             return results
         
-        # Build results from matched stops
+        # Build results from ranked stops
         seen = set()
-        for stop_id in matched_stops:
-            stop_data = self._search_index["stops"].get(stop_id)
-            if not stop_data:
-                continue
-            
+        for _, stop_pos in ranked:
+            stop_data = index.stop(stop_pos)
+            stop_id = stop_data["id"]
             stop_name = stop_data["name"]
             
             # Create one result per line at this stop
@@ -332,67 +645,87 @@ class IDFMClient:
                     transport_type=t_type,
                     town=""  # Town info not in perimeter CSV
                 ))
+                if len(results) >= SEARCH_LIMIT:
+                    return results
         
-        # Sort by relevance (exact matches first, then by stop name)
-        try:
-            query_normalized = self._normalize_text(query)
-            results.sort(key=lambda r: (
-                0 if query_normalized == self._normalize_text(r.stop_name) else 1,
-                r.stop_name.lower()
-            ))
-        except:
-            # If sorting fails, just return unsorted
-            pass
+        return results
+    
+    def _search_lines_local(self, query: str) -> List[Dict[str, Any]]:
+        """Stops of the lines named query, from the local catalogue"""
+        index = self._search_index
+        if not index.has_catalogue:
+            return []
         
-        return results[:30]
+        results = []
+        for line_pos in index.find_lines(query):
+            line = index.line(line_pos)
+            stops = sorted(
+                (index.strings[index.stop_name[stop_pos]], index.strings[index.stop_id[stop_pos]])
+                for stop_pos in index.line_stop_positions(line_pos)
+            )
+            for stop_name, stop_id in stops:
+                results.append({
+                    "stop_id": stop_id,
+                    "stop_name": stop_name,
+                    "line_id": line["line_id"],
+                    "line_name": line["line_name"],
+                    "transport_type": line["transport_type"],
+                    "town": ""  # Town info not in perimeter CSV
+                })
+                if len(results) >= 50:
+                    return results
+        return results
     
+    @cached("search_lines", ttl=21600, maxsize=256, key=lambda query: query.strip().lower())
     async def search_lines(self, query: str) -> List[Dict[str, Any]]:
         """Search for stops by line number"""
-        results = []
+        results = self._search_lines_local(query)
+        if results:
+            return results
         
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                url = f"{OPENDATA_URL}/arrets-lignes/records"
-                params = {
-                    "where": f"shortname = '{query}' OR route_long_name = '{query}'",
-                    "limit": 50,
-                    "select": "stop_id,stop_name,route_long_name,shortname,mode,id,nom_commune"
-                }
-                
-                response = await client.get(url, params=params)
+            client = self._http(OPENDATA_URL)
+            url = f"{OPENDATA_URL}/arrets-lignes/records"
+            params = {
+                "where": f"shortname = '{query}' OR route_long_name = '{query}'",
+                "limit": 50,
+                "select": "stop_id,stop_name,route_long_name,shortname,mode,id,nom_commune"
+            }
+            
+            response = await client.get(url, params=params)
+            
+            if response.status_code == 200:
+                data = response.json()
+                records = data.get("results", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    records = data.get("results", [])
+                seen = set()
+                for record in records:
+                    stop_id_raw = record.get("stop_id", "")
+                    stop_name = record.get("stop_name", "")
+                    line_name = record.get("shortname") or record.get("route_long_name", "")
+                    mode = record.get("mode", "Bus")
+                    line_id_raw = record.get("id", "")
+                    town = record.get("nom_commune", "")
                     
-                    seen = set()
-                    for record in records:
-                        stop_id_raw = record.get("stop_id", "")
-                        stop_name = record.get("stop_name", "")
-                        line_name = record.get("shortname") or record.get("route_long_name", "")
-                        mode = record.get("mode", "Bus")
-                        line_id_raw = record.get("id", "")
-                        town = record.get("nom_commune", "")
-                        
-                        stop_id = self._convert_stop_id(stop_id_raw)
-                        line_id = self._convert_line_id_from_opendata(line_id_raw)
-                        t_type = self._mode_name_to_transport(mode)
-                        
-                        key = f"{stop_id}:{line_name}"
-                        if key in seen:
-                            continue
-                        seen.add(key)
-                        
-                        results.append({
-                            "stop_id": stop_id,
-                            "stop_name": stop_name,
-                            "line_id": line_id,
-                            "line_name": line_name,
-                            "transport_type": t_type,
-                            "town": town
-                        })
+                    stop_id = self._convert_stop_id(stop_id_raw)
+                    line_id = self._convert_line_id_from_opendata(line_id_raw)
+                    t_type = self._mode_name_to_transport(mode)
+                    
+                    key = f"{stop_id}:{line_name}"
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    
+                    results.append({
+                        "stop_id": stop_id,
+                        "stop_name": stop_name,
+                        "line_id": line_id,
+                        "line_name": line_name,
+                        "transport_type": t_type,
+                        "town": town
+                    })
         except Exception as e:
-            print(f"Line search error: {e}")
+            logger.warning("Line search error: %s", e)
         
         return results[:50]
     
@@ -400,184 +733,135 @@ class IDFMClient:
     
     async def get_departures(self, stop_config: StopConfig) -> StopDepartures:
         """Get real-time departures using PRIM stop-monitoring API"""
+        results = await self.get_departures_group([stop_config])
+        return results[0]
+    
+    async def get_departures_group(self, stop_configs: List[StopConfig]) -> List[StopDepartures]:
+        """
+        Get departures for several stops sharing the same MonitoringRef with a single
+        PRIM call. Line and direction filters are applied locally for each stop.
+        Returns one StopDepartures per stop config, in the same order.
+        """
         now = self._get_paris_time()
+        monitoring_ref = stop_configs[0].id
         
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                url = f"{PRIM_BASE_URL}/stop-monitoring"
-                params = {"MonitoringRef": stop_config.id}
-                
-                if stop_config.line_id:
-                    params["LineRef"] = stop_config.line_id
-                
-                response = await client.get(url, headers=self.prim_headers, params=params)
-                
-                if response.status_code == 400:
-                    return StopDepartures(
-                        stop_id=stop_config.id, stop_name=stop_config.name,
-                        line=stop_config.line, line_id=stop_config.line_id,
-                        direction=stop_config.direction, last_updated=now,
-                        departures=[], error="Arrêt inconnu"
-                    )
-                elif response.status_code != 200:
-                    return StopDepartures(
-                        stop_id=stop_config.id, stop_name=stop_config.name,
-                        line=stop_config.line, line_id=stop_config.line_id,
-                        direction=stop_config.direction, last_updated=now,
-                        departures=[], error=f"Erreur {response.status_code}"
-                    )
-                
-                data = response.json()
-                departures = self._parse_departures(data, stop_config)
-                
-                return StopDepartures(
-                    stop_id=stop_config.id, stop_name=stop_config.name,
-                    line=stop_config.line, line_id=stop_config.line_id,
-                    direction=stop_config.direction, last_updated=now,
+            params = {"MonitoringRef": monitoring_ref}
+            
+            # Only filter remotely when every stop in the group wants the same line
+            line_ids = {s.line_id for s in stop_configs}
+            if len(line_ids) == 1 and stop_configs[0].line_id:
+                params["LineRef"] = stop_configs[0].line_id
+            
+            if self.stream_departures:
+                async with self._prim_stream("stop-monitoring", params) as response:
+                    errors = self._group_errors(response, stop_configs, now)
+                    if errors:
+                        return errors
+                    selection = await self._select_streamed(response, stop_configs, now)
+            else:
+                response = await self._prim_get("stop-monitoring", params)
+                errors = self._group_errors(response, stop_configs, now)
+                if errors:
+                    return errors
+                # Decoded once for all the stops of the group
+                selection = DepartureSelection(stop_configs, now)
+                with PARSE_SECONDS.time():
+                    selection.extend(decode_visits(response.content))
+            
+            return [
+                StopDepartures(
+                    stop_id=s.id, stop_name=s.name,
+                    line=s.line, line_id=s.line_id,
+                    direction=s.direction, last_updated=now,
                     departures=departures
                 )
-                
+                for s, departures in zip(stop_configs, selection.departures())
+            ]
+            
+        except RateLimitError:
+            raise
         except httpx.TimeoutException:
-            return StopDepartures(
-                stop_id=stop_config.id, stop_name=stop_config.name,
-                line=stop_config.line, direction=stop_config.direction,
-                last_updated=now, departures=[], error="Timeout"
-            )
+            return [self._error_departures(s, now, "Timeout") for s in stop_configs]
         except Exception as e:
-            return StopDepartures(
-                stop_id=stop_config.id, stop_name=stop_config.name,
-                line=stop_config.line, direction=stop_config.direction,
-                last_updated=now, departures=[], error=str(e)
-            )
+            return [self._error_departures(s, now, str(e)) for s in stop_configs]
     
-    def _parse_departures(self, data: dict, stop_config: StopConfig) -> List[Departure]:
-        departures = []
-        try:
-            delivery = data.get("Siri", {}).get("ServiceDelivery", {}).get("StopMonitoringDelivery", [])
-            if not delivery:
-                print(f"[DEBUG] No StopMonitoringDelivery in response")
-                return departures
-            
-            visits = delivery[0].get("MonitoredStopVisit", [])
-            print(f"[DEBUG] Found {len(visits)} monitored visits")
-            
-            for visit in visits:
-                journey = visit.get("MonitoredVehicleJourney", {})
-                call = journey.get("MonitoredCall", {})
-                
-                line_ref = journey.get("LineRef", {}).get("value", "")
-                line_name = self._extract_line_name(line_ref, journey)
-                
-                dest_names = journey.get("DestinationName", [])
-                direction = dest_names[0].get("value", "") if dest_names else ""
-                
-                print(f"[DEBUG] Visit: line={line_name}, direction={direction}")
-                
-                # Filter by direction if specified (skip if "Toutes directions")
-                if stop_config.direction and "toutes directions" not in stop_config.direction.lower():
-                    if not self._direction_matches(stop_config.direction, direction):
-                        print(f"[DEBUG] Filtered out: {direction} doesn't match {stop_config.direction}")
-                        continue
-                
-                aimed_time = call.get("AimedDepartureTime") or call.get("AimedArrivalTime", "")
-                expected_time = call.get("ExpectedDepartureTime") or call.get("ExpectedArrivalTime", "")
-                
-                if not aimed_time and not expected_time:
-                    print(f"[DEBUG] No time data for this visit")
-                    continue
-                
-                scheduled = self._parse_idfm_time(aimed_time or expected_time)
-                expected = self._parse_idfm_time(expected_time or aimed_time)
-                delay_minutes = int((expected - scheduled).total_seconds() / 60)
-                
-                departure_status = call.get("DepartureStatus", "")
-                if "cancelled" in departure_status.lower():
-                    status = "Supprimé"
-                elif delay_minutes > 2:
-                    status = "Retardé"
-                elif delay_minutes < -1:
-                    status = "En avance"
-                else:
-                    status = "À l'heure"
-                
-                departures.append(Departure(
-                    line=line_name, line_id=line_ref, direction=direction,
-                    scheduled=scheduled, expected=expected,
-                    delay_minutes=delay_minutes, status=status,
-                    is_realtime=bool(expected_time)
-                ))
-            
-            departures.sort(key=lambda d: d.expected)
-            return departures[:6]
-        except Exception as e:
-            print(f"Parse error: {e}")
-            return departures
+    def _group_errors(self, response: httpx.Response, stop_configs: List[StopConfig],
+                      now: datetime) -> Optional[List[StopDepartures]]:
+        """Error results for an unsuccessful StopMonitoring response, None on success"""
+        if response.status_code == 429:
+            raise RateLimitError("API rate limit exceeded")
+        elif response.status_code == 400:
+            return [self._error_departures(s, now, "Arrêt inconnu") for s in stop_configs]
+        elif response.status_code != 200:
+            return [self._error_departures(s, now, f"Erreur {response.status_code}") for s in stop_configs]
+        return None
+    
+    async def _select_streamed(self, response: httpx.Response, stop_configs: List[StopConfig],
+                               now: datetime) -> DepartureSelection:
+        """Feed the visits of a streamed response to the selection as they are decoded"""
+        scanner = VisitScanner()
+        selection = DepartureSelection(stop_configs, now)
+        parse_seconds = 0.0
+        # The body is read to the end so the connection can be reused
+        async for chunk in response.aiter_bytes():
+            started = time.perf_counter()
+            selection.extend(scanner.feed(chunk))
+            parse_seconds += time.perf_counter() - started
+        scanner.close()
+        PARSE_SECONDS.observe(parse_seconds)
+        logger.debug("Streamed %d monitored visits for %s", scanner.count, stop_configs[0].id)
+        return selection
+    
+    def _error_departures(self, stop_config: StopConfig, now: datetime, error: str) -> StopDepartures:
+        return StopDepartures(
+            stop_id=stop_config.id, stop_name=stop_config.name,
+            line=stop_config.line, line_id=stop_config.line_id,
+            direction=stop_config.direction, last_updated=now,
+            departures=[], error=error
+        )
     
+    @cached("stop_directions", ttl=3600, maxsize=512, key=lambda stop_id, line_id=None: (stop_id, line_id))
     async def get_stop_directions(self, stop_id: str, line_id: str = None) -> List[Dict[str, Any]]:
         """Get directions from real-time PRIM API"""
         directions = []
         
         try:
-            async with httpx.AsyncClient(timeout=15) as client:
-                url = f"{PRIM_BASE_URL}/stop-monitoring"
-                params = {"MonitoringRef": stop_id}
-                if line_id:
-                    params["LineRef"] = line_id
-                
-                response = await client.get(url, headers=self.prim_headers, params=params)
+            params = {"MonitoringRef": stop_id}
+            if line_id:
+                params["LineRef"] = line_id
+            
+            response = await self._prim_get("stop-monitoring", params)
+            
+            if response.status_code == 200:
+                seen = set()
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    delivery = data.get("Siri", {}).get("ServiceDelivery", {}).get("StopMonitoringDelivery", [])
+                for visit in monitored_visits(loads(response.content)):
+                    journey = visit.get("MonitoredVehicleJourney", {})
+                    dest_names = journey.get("DestinationName", [])
+                    dest_ref = journey.get("DestinationRef", {}).get("value", "")
+                    line_ref = journey.get("LineRef", {}).get("value", "")
                     
-                    if delivery:
-                        visits = delivery[0].get("MonitoredStopVisit", [])
-                        seen = set()
+                    if dest_names:
+                        direction = dest_names[0].get("value", "")
+                        key = f"{line_ref}:{direction}"
                         
-                        for visit in visits:
-                            journey = visit.get("MonitoredVehicleJourney", {})
-                            dest_names = journey.get("DestinationName", [])
-                            dest_ref = journey.get("DestinationRef", {}).get("value", "")
-                            line_ref = journey.get("LineRef", {}).get("value", "")
-                            
-                            if dest_names:
-                                direction = dest_names[0].get("value", "")
-                                key = f"{line_ref}:{direction}"
-                                
-                                if key not in seen:
-                                    seen.add(key)
-                                    line_name = self._extract_line_name(line_ref, journey)
-                                    directions.append({
-                                        "direction": direction,
-                                        "direction_id": dest_ref,
-                                        "line_id": line_ref,
-                                        "line_name": line_name
-                                    })
+                        if key not in seen:
+                            seen.add(key)
+                            line_name = extract_line_name(line_ref, journey)
+                            directions.append({
+                                "direction": direction,
+                                "direction_id": dest_ref,
+                                "line_id": line_ref,
+                                "line_name": line_name
+                            })
         except Exception as e:
-            print(f"Get directions error: {e}")
+            logger.warning("Get directions error: %s", e)
         
         return directions
     
     # ==================== HELPERS ====================
     
-    def _direction_matches(self, config_dir: str, api_dir: str) -> bool:
-        c = config_dir.lower().strip()
-        a = api_dir.lower().strip()
-        return c in a or a in c
-    
-    def _extract_line_name(self, line_ref: str, journey: dict) -> str:
-        pub_names = journey.get("PublishedLineName", [])
-        if pub_names:
-            return pub_names[0].get("value", "")
-        if line_ref:
-            parts = line_ref.split(":")
-            if len(parts) >= 4:
-                code = parts[3]
-                if code.startswith("C0"):
-                    code = code[2:].lstrip("0") or "0"
-                return code
-        return "?"
-    
     def _convert_stop_id(self, raw_id: str) -> str:
         """Convert Open Data stop_id to STIF format for PRIM API"""
         if raw_id.startswith("STIF:"):
@@ -599,6 +883,11 @@ class IDFMClient:
         
         return raw_id
     
+    def _raw_stop_id(self, stop_id: str) -> str:
+        """Convert a STIF stop id back to the Open Data format (inverse of _convert_stop_id)"""
+        match = re.match(r'STIF:StopPoint:Q:(\d+):', stop_id)
+        return f"IDFM:{match.group(1)}" if match else stop_id
+    
     def _convert_line_id_from_opendata(self, raw_id: str) -> str:
         """Convert Open Data line id to STIF format"""
         if raw_id.startswith("STIF:"):
@@ -626,28 +915,28 @@ class IDFMClient:
     async def test_connection(self) -> Dict[str, Any]:
         """Test PRIM API connection"""
         try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                url = f"{PRIM_BASE_URL}/stop-monitoring"
-                params = {"MonitoringRef": "STIF:StopPoint:Q:473921:"}
-                
-                response = await client.get(url, headers=self.prim_headers, params=params)
+            params = {"MonitoringRef": "STIF:StopPoint:Q:473921:"}
+            
+            response = await self._prim_get("stop-monitoring", params, timeout=10)
+            
+            if response.status_code == 200:
+                data = response.json()
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    # Check for rate limit in response body
-                    if isinstance(data, dict) and "rate limit" in str(data.get("message", "")).lower():
-                        return {"success": False, "message": "API rate limit exceeded"}
-                    
-                    if "Siri" in data:
-                        return {"success": True, "message": "API connectée ✓"}
-                    return {"success": False, "message": "Réponse invalide"}
-                elif response.status_code in [401, 403]:
-                    return {"success": False, "message": "Clé API invalide"}
-                elif response.status_code == 429:
+                # Check for rate limit in response body
+                if isinstance(data, dict) and "rate limit" in str(data.get("message", "")).lower():
                     return {"success": False, "message": "API rate limit exceeded"}
-                else:
-                    return {"success": False, "message": f"Erreur {response.status_code}"}
+                
+                if "Siri" in data:
+                    return {"success": True, "message": "API connectée ✓"}
+                return {"success": False, "message": "Réponse invalide"}
+            elif response.status_code in [401, 403]:
+                return {"success": False, "message": "Clé API invalide"}
+            elif response.status_code == 429:
+                return {"success": False, "message": "API rate limit exceeded"}
+            else:
+                return {"success": False, "message": f"Erreur {response.status_code}"}
+        except RateLimitError:
+            return {"success": False, "message": "API rate limit exceeded"}
         except httpx.TimeoutException:
             return {"success": False, "message": "Timeout"}
         except Exception as e:
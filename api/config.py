@@ -1,24 +1,205 @@
 import yaml
 import json
+import atexit
+import copy
+import threading
+import time
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from .fileio import atomic_write
+from .log import get_logger
 from .models import StopConfig
 
+logger = get_logger("config")
+
+
+def file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, None if it does not exist"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ConfigWriter:
+    """
+    Writes the config file from a background thread. Saves requested less
+    than `delay` seconds apart are coalesced into a single write, done at
+    most `max_delay` seconds after the first one. Writes are atomic (see
+    fileio.atomic_write), so a crash leaves either the old or the new file.
+    """
+    
+    def __init__(self, path: Path, delay: float = 0.5, max_delay: float = 5.0):
+        self.path = path
+        self.delay = delay
+        self.max_delay = max_delay
+        self.writes = 0
+        # Signature of the file as last read or written by us
+        self.signature = file_signature(path)
+        self._cond = threading.Condition()
+        self._pending: Optional[dict] = None
+        self._first_request = 0.0
+        self._last_request = 0.0
+        self._writing = False
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def pending(self) -> bool:
+        """True while a save is waiting or being written"""
+        with self._cond:
+            return self._pending is not None or self._writing
+    
+    def submit(self, data: dict):
+        """Schedule a write of data, replacing any write not started yet"""
+        with self._cond:
+            now = time.monotonic()
+            if self._pending is None:
+                self._first_request = now
+            self._pending = data
+            self._last_request = now
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="config-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+    
+    def flush(self):
+        """Write the pending save now, after any write in progress"""
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            data, self._pending = self._pending, None
+            if data is None:
+                return
+            self._writing = True
+        self._write_and_release(data)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending is None or self._writing:
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    due = min(self._last_request + self.delay, self._first_request + self.max_delay)
+                    if now >= due:
+                        break
+                    self._cond.wait(due - now)
+                data, self._pending = self._pending, None
+                self._writing = True
+            self._write_and_release(data)
+    
+    def _write_and_release(self, data: dict):
+        try:
+            self._write(data)
+        except Exception as e:
+            logger.error("Could not save config to %s: %s", self.path, e)
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+    
+    def _write(self, data: dict):
+        text = yaml.dump(data, default_flow_style=False, allow_unicode=True)
+        with atomic_write(self.path) as f:
+            f.write(text)
+        self.signature = file_signature(self.path)
+        self.writes += 1
+
+
+class StopsSnapshot:
+    """
+    Parsed stops of one config version, indexed by (id, direction) and by id.
+    Never modified: the config manager swaps in a new snapshot on each change.
+    """
+    
+    __slots__ = ("version", "stops", "_by_key", "_by_id")
+    
+    def __init__(self, version: int, stops: Tuple[StopConfig, ...]):
+        self.version = version
+        self.stops = stops
+        by_key: Dict[Tuple[str, Optional[str]], int] = {}
+        by_id: Dict[str, List[int]] = {}
+        for i, stop in enumerate(stops):
+            by_key.setdefault((stop.id, stop.direction), i)
+            by_id.setdefault(stop.id, []).append(i)
+        self._by_key = by_key
+        self._by_id = {stop_id: tuple(positions) for stop_id, positions in by_id.items()}
+    
+    def __len__(self) -> int:
+        return len(self.stops)
+    
+    def __iter__(self) -> Iterator[StopConfig]:
+        return iter(self.stops)
+    
+    def __getitem__(self, index: int) -> StopConfig:
+        return self.stops[index]
+    
+    def index(self, stop_id: str, direction: Optional[str]) -> Optional[int]:
+        """Position of the stop with this id and direction, or None"""
+        return self._by_key.get((stop_id, direction))
+    
+    def get(self, stop_id: str, direction: Optional[str]) -> Optional[StopConfig]:
+        i = self._by_key.get((stop_id, direction))
+        return None if i is None else self.stops[i]
+    
+    def positions(self, stop_id: str) -> Tuple[int, ...]:
+        """Positions of all the stops with this id, whatever their direction"""
+        return self._by_id.get(stop_id, ())
+
 
 class ConfigManager:
     """Manages transit dashboard configuration"""
     
-    def __init__(self, config_path: str = "config.yaml"):
+    # Minimum time between checks of the config file for external edits
+    CHECK_INTERVAL = 5
+    
+    def __init__(self, config_path: str = "config.yaml", save_delay: float = 0.5):
         self.config_path = Path(config_path)
+        self._writer = ConfigWriter(self.config_path, delay=save_delay)
         self.config = self._load_config()
+        # Bumped on every change, lets caches of derived data know they are stale
+        self.version = 0
+        self._stops: Optional[StopsSnapshot] = None
+        # Called with the (added, removed) stops whenever the stop list changes
+        self.on_stops_change: List[Callable[[Tuple[StopConfig, ...], Tuple[StopConfig, ...]], None]] = []
+        self._next_check = time.monotonic() + self.CHECK_INTERVAL
+        # Pending saves must not be lost when the process exits
+        atexit.register(self.flush)
     
     def _load_config(self) -> dict:
         """Load configuration from YAML file"""
         if self.config_path.exists():
-            with open(self.config_path) as f:
+            self._writer.signature = file_signature(self.config_path)
+            with open(self.config_path, encoding="utf-8") as f:
                 return yaml.safe_load(f) or self._default_config()
         return self._default_config()
     
+    def check_external_edit(self) -> bool:
+        """
+        Reload the config if the file was changed by someone else (the CLI,
+        a text editor, ...). Checks at most every CHECK_INTERVAL seconds;
+        True if the config was reloaded.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.CHECK_INTERVAL
+        
+        signature = file_signature(self.config_path)
+        if signature is None or signature == self._writer.signature or self._writer.pending:
+            return False
+        try:
+            config = self._load_config()
+        except (OSError, yaml.YAMLError) as e:
+            logger.warning("Config file %s changed but could not be read: %s", self.config_path, e)
+            return False
+        logger.info("Config file %s changed on disk, reloaded", self.config_path)
+        self.config = config
+        self.version += 1
+        return True
+    
     def _default_config(self) -> dict:
         """Return default configuration"""
         return {
@@ -34,9 +215,14 @@ class ConfigManager:
         }
     
     def save(self):
-        """Save configuration to file"""
-        with open(self.config_path, 'w') as f:
-            yaml.dump(self.config, f, default_flow_style=False, allow_unicode=True)
+        """Save configuration to file, in the background (see ConfigWriter)"""
+        self.version += 1
+        # Written from another thread: hand it a copy the caller can't modify
+        self._writer.submit(copy.deepcopy(self.config))
+    
+    def flush(self):
+        """Write pending changes now (blocking)"""
+        self._writer.flush()
     
     @property
     def api_key(self) -> str:
@@ -65,59 +251,145 @@ class ConfigManager:
         return self.config.get("display", {}).get("max_departures_per_stop", 3)
     
     @property
-    def stops(self) -> List[StopConfig]:
+    def max_refresh_interval(self) -> int:
+        """Longest time a stop may go without refresh under adaptive scheduling"""
+        return self.config.get("api", {}).get("max_refresh_interval_seconds", 300)
+    
+    @property
+    def max_concurrent_requests(self) -> int:
+        """Maximum number of PRIM requests in flight during a refresh cycle"""
+        return self.config.get("api", {}).get("max_concurrent_requests", 8)
+    
+    @property
+    def stop_timeout(self) -> float:
+        """Timeout in seconds for fetching a single stop"""
+        return self.config.get("api", {}).get("stop_timeout_seconds", 10)
+    
+    @property
+    def cycle_deadline(self) -> float:
+        """Deadline in seconds for a whole refresh cycle"""
+        return self.config.get("api", {}).get("cycle_deadline_seconds", 25)
+    
+    @property
+    def daily_quota(self) -> int:
+        """PRIM requests allowed per day for the API key"""
+        return self.config.get("api", {}).get("daily_quota", 20000)
+    
+    @property
+    def requests_per_second(self) -> float:
+        """PRIM requests allowed per second for the API key"""
+        return self.config.get("api", {}).get("requests_per_second", 5)
+    
+    @property
+    def rate_budget_file(self) -> str:
+        """File keeping each API key's daily request count across restarts"""
+        default = str(self.config_path.with_name("rate_budget.json"))
+        return self.config.get("api", {}).get("rate_budget_file", default)
+    
+    @property
+    def http_limits(self) -> dict:
+        """Connection pool limits for the API clients (max_connections, ...)"""
+        return self.config.get("http", {}).get("limits", {})
+    
+    @property
+    def http2(self) -> bool:
+        return self.config.get("http", {}).get("http2", True)
+    
+    @property
+    def stream_departures(self) -> bool:
+        """Decode StopMonitoring responses while they download"""
+        return self.config.get("http", {}).get("stream_departures", True)
+    
+    @property
+    def cache_ttls(self) -> dict:
+        """TTL overrides in seconds for the lookup caches, by cache name"""
+        return self.config.get("cache", {}).get("ttl_seconds", {})
+    
+    @property
+    def cache_file(self) -> Optional[str]:
+        """File where lookup caches are saved across restarts (disabled if unset)"""
+        return self.config.get("cache", {}).get("file")
+    
+    @property
+    def stops_snapshot(self) -> StopsSnapshot:
+        """Parsed stops of the current config version, rebuilt only after a change"""
+        self.check_external_edit()
+        snapshot = self._stops
+        if snapshot is None or snapshot.version != self.version:
+            stops_data = self.config.get("stops") or []
+            snapshot = StopsSnapshot(self.version, tuple(StopConfig(**s) for s in stops_data))
+            self._set_stops_snapshot(snapshot)
+        return snapshot
+    
+    def _set_stops_snapshot(self, snapshot: StopsSnapshot):
+        """Install a new snapshot and tell listeners which stops were added or removed"""
+        previous = self._stops
+        self._stops = snapshot
+        if previous is None or not self.on_stops_change:
+            return
+        
+        # An edited stop shows up as removed (old settings) and added (new ones)
+        old, new = set(previous.stops), set(snapshot.stops)
+        added = tuple(s for s in snapshot.stops if s not in old)
+        removed = tuple(s for s in previous.stops if s not in new)
+        if not added and not removed:
+            return
+        for listener in self.on_stops_change:
+            try:
+                listener(added, removed)
+            except Exception:
+                logger.exception("Stop change listener failed")
+    
+    @property
+    def stops(self) -> Tuple[StopConfig, ...]:
         """Get list of configured stops"""
-        stops_data = self.config.get("stops", [])
-        return [StopConfig(**s) for s in stops_data]
+        return self.stops_snapshot.stops
+    
+    def _replace_stops(self, stops_data: List[dict], stops: Tuple[StopConfig, ...]):
+        """Save a new stop list, given both raw and parsed (in the same order)"""
+        self.config["stops"] = stops_data
+        self.save()
+        self._set_stops_snapshot(StopsSnapshot(self.version, stops))
     
     def add_stop(self, stop: StopConfig) -> bool:
         """Add a new stop configuration"""
-        if "stops" not in self.config:
-            self.config["stops"] = []
+        snapshot = self.stops_snapshot
         
         # Check for duplicates
-        for existing in self.config["stops"]:
-            if existing["id"] == stop.id and existing.get("direction") == stop.direction:
-                return False  # Already exists
+        if snapshot.index(stop.id, stop.direction) is not None:
+            return False  # Already exists
         
-        self.config["stops"].append(stop.model_dump())
-        self.save()
+        self._replace_stops((self.config.get("stops") or []) + [stop.model_dump(exclude_none=True)], snapshot.stops + (stop,))
         return True
     
     def remove_stop(self, stop_id: str, direction: str = None) -> bool:
         """Remove a stop configuration"""
-        if "stops" not in self.config:
-            return False
-        
-        initial_count = len(self.config["stops"])
+        snapshot = self.stops_snapshot
         
         if direction:
-            self.config["stops"] = [
-                s for s in self.config["stops"]
-                if not (s["id"] == stop_id and s.get("direction") == direction)
-            ]
+            removed = {i for i in snapshot.positions(stop_id) if snapshot[i].direction == direction}
         else:
-            self.config["stops"] = [
-                s for s in self.config["stops"]
-                if s["id"] != stop_id
-            ]
+            removed = set(snapshot.positions(stop_id))
         
-        if len(self.config["stops"]) < initial_count:
-            self.save()
-            return True
-        return False
+        if not removed:
+            return False
+        
+        kept = [i for i in range(len(snapshot)) if i not in removed]
+        stops_data = self.config["stops"]
+        self._replace_stops([stops_data[i] for i in kept], tuple(snapshot[i] for i in kept))
+        return True
     
     def update_stop(self, stop_id: str, old_direction: str, new_stop: StopConfig) -> bool:
         """Update an existing stop configuration"""
-        if "stops" not in self.config:
+        snapshot = self.stops_snapshot
+        i = snapshot.index(stop_id, old_direction)
+        if i is None:
             return False
         
-        for i, s in enumerate(self.config["stops"]):
-            if s["id"] == stop_id and s.get("direction") == old_direction:
-                self.config["stops"][i] = new_stop.model_dump()
-                self.save()
-                return True
-        return False
+        stops_data = list(self.config["stops"])
+        stops_data[i] = new_stop.model_dump(exclude_none=True)
+        self._replace_stops(stops_data, snapshot.stops[:i] + (new_stop,) + snapshot.stops[i + 1:])
+        return True
     
     def reorder_stops(self, new_order: List[int]) -> bool:
         """Reorder stops by providing new indices"""
@@ -125,16 +397,17 @@ class ConfigManager:
             return False
         
         try:
+            snapshot = self.stops_snapshot
             old_stops = self.config["stops"]
-            self.config["stops"] = [old_stops[i] for i in new_order if i < len(old_stops)]
-            self.save()
+            order = [i for i in new_order if i < len(old_stops)]
+            self._replace_stops([old_stops[i] for i in order], tuple(snapshot[i] for i in order))
             return True
         except Exception:
             return False
     
     def get_stop_by_index(self, index: int) -> Optional[StopConfig]:
         """Get a stop by its index"""
-        stops = self.stops
+        stops = self.stops_snapshot
         if 0 <= index < len(stops):
             return stops[index]
         return None
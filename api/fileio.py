@@ -0,0 +1,45 @@
+"""
+Atomic file writes
+Files read by a running process (config, caches, search index) are written
+to a temp file next to them, fsynced, then renamed over the original, so a
+crash or a concurrent reader only ever sees the old or the new content.
+"""
+import os
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "w", encoding: Optional[str] = "utf-8") -> Iterator[IO]:
+    """Open a temp file for writing, renamed over path when the block succeeds"""
+    path = os.fspath(path)
+    tmp_path = f"{path}.tmp"
+    if "b" in mode:
+        encoding = None
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+def _fsync_dir(directory: str):
+    """Make a rename in directory durable (not supported everywhere)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
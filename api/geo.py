@@ -0,0 +1,243 @@
+"""
+Geographic helpers for the local stop index
+Conversion of the Lambert-93 (EPSG:2154) coordinates found in the IDFM
+data to WGS84 latitude/longitude, distances, and the fixed grid used to
+bucket stops for nearby-stop lookups.
+Bulk distances use NumPy when it is installed, pure Python otherwise;
+`python -m api.geo` benchmarks both against the scalar haversine.
+"""
+import math
+import random
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional: bulk distances fall back to pure Python
+    np = None
+
+NUMPY_AVAILABLE = np is not None
+
+EARTH_RADIUS_M = 6371000
+
+# Below this radius the equirectangular approximation is within 0.1% of haversine
+EQUIRECTANGULAR_MAX_M = 20000
+
+# Below this number of points NumPy's call overhead outweighs the loop
+NUMPY_MIN_POINTS = 64
+
+# ==================== LAMBERT-93 ====================
+
+# GRS80 ellipsoid (RGF93, which matches WGS84 to within a few centimetres)
+_E = 0.0818191910428158
+# Lambert-93 projection constants (IGN, NTG_71)
+_N = 0.7256077650532670
+_C = 11754255.426096
+_XS = 700000.0
+_YS = 12655612.049876
+_LON0 = math.radians(3.0)
+
+# Rough bounds of metropolitan France in Lambert-93, to reject junk values
+_X_RANGE = (0.0, 1300000.0)
+_Y_RANGE = (6000000.0, 7200000.0)
+
+
+def lambert93_to_wgs84(x: float, y: float) -> Tuple[float, float]:
+    """Convert Lambert-93 (EPSG:2154) coordinates in metres to (lat, lon) in degrees"""
+    dx = x - _XS
+    dy = _YS - y
+    r = math.hypot(dx, dy)
+    gamma = math.atan2(dx, dy)
+    lon = _LON0 + gamma / _N
+    iso_lat = -math.log(r / _C) / _N
+
+    # Latitude from the isometric latitude, by fixed-point iteration
+    exp_l = math.exp(iso_lat)
+    lat = 2 * math.atan(exp_l) - math.pi / 2
+    for _ in range(20):
+        e_sin = _E * math.sin(lat)
+        next_lat = 2 * math.atan(((1 + e_sin) / (1 - e_sin)) ** (_E / 2) * exp_l) - math.pi / 2
+        if abs(next_lat - lat) < 1e-12:
+            lat = next_lat
+            break
+        lat = next_lat
+
+    return math.degrees(lat), math.degrees(lon)
+
+
+def parse_lambert93(x: Optional[str], y: Optional[str]) -> Optional[Tuple[float, float]]:
+    """(lat, lon) from Lambert-93 values as found in a CSV, or None if missing or invalid"""
+    try:
+        fx = float(str(x).strip().replace(",", "."))
+        fy = float(str(y).strip().replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+    if not (_X_RANGE[0] < fx < _X_RANGE[1] and _Y_RANGE[0] < fy < _Y_RANGE[1]):
+        return None
+    return lambert93_to_wgs84(fx, fy)
+
+
+# ==================== DISTANCES ====================
+
+def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Calculate distance between two points in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return EARTH_RADIUS_M * c
+
+
+def equirectangular_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Approximate distance in meters, accurate for short distances"""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+def _distances_numpy(lat: float, lon: float, lats, lons, method: str):
+    lat1 = math.radians(lat)
+    lats = np.radians(lats)
+    dlon = np.radians(lons) - math.radians(lon)
+    if method == "equirectangular":
+        x = dlon * np.cos((lats + lat1) / 2)
+        return EARTH_RADIUS_M * np.hypot(x, lats - lat1)
+    a = np.sin((lats - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lats) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distances(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float],
+              method: str = "haversine") -> Sequence[float]:
+    """
+    Distances in meters from one point to arrays of coordinates, in one
+    NumPy pass when available ("haversine" or "equirectangular")
+    """
+    if NUMPY_AVAILABLE and len(lats) >= NUMPY_MIN_POINTS:
+        return _distances_numpy(lat, lon, np.asarray(lats, dtype=np.float64),
+                                np.asarray(lons, dtype=np.float64), method)
+    distance = equirectangular_distance if method == "equirectangular" else haversine_distance
+    return [distance(lat, lon, la, lo) for la, lo in zip(lats, lons)]
+
+
+def within_radius(lat: float, lon: float, lats: Sequence[float], lons: Sequence[float],
+                  radius_m: float, subset: Optional[Sequence[int]] = None) -> List[Tuple[float, int]]:
+    """
+    (distance, index) of the points within radius_m, nearest first.
+    Points outside the bounding box are dropped before any trigonometry,
+    and short radii use the equirectangular approximation. `subset`
+    restricts the search to some indices (e.g. grid candidates).
+    NaN coordinates never match.
+    """
+    min_lat, min_lon, max_lat, max_lon = bounding_box(lat, lon, radius_m)
+    method = "equirectangular" if radius_m <= EQUIRECTANGULAR_MAX_M else "haversine"
+    count = len(subset) if subset is not None else len(lats)
+
+    if NUMPY_AVAILABLE and count >= NUMPY_MIN_POINTS:
+        la = np.asarray(lats, dtype=np.float64)
+        lo = np.asarray(lons, dtype=np.float64)
+        if subset is not None:
+            idx = np.asarray(subset, dtype=np.intp)
+            la, lo = la[idx], lo[idx]
+        else:
+            idx = np.arange(len(la))
+        in_box = (la >= min_lat) & (la <= max_lat) & (lo >= min_lon) & (lo <= max_lon)
+        idx, la, lo = idx[in_box], la[in_box], lo[in_box]
+        d = _distances_numpy(lat, lon, la, lo, method)
+        keep = d <= radius_m
+        idx, d = idx[keep], d[keep]
+        order = np.argsort(d, kind="stable")
+        return list(zip(d[order].tolist(), idx[order].tolist()))
+
+    distance = equirectangular_distance if method == "equirectangular" else haversine_distance
+    found = []
+    for i in (subset if subset is not None else range(len(lats))):
+        la, lo = lats[i], lons[i]
+        if min_lat <= la <= max_lat and min_lon <= lo <= max_lon:
+            d = distance(lat, lon, la, lo)
+            if d <= radius_m:
+                found.append((d, i))
+    found.sort()
+    return found
+
+
+def bounding_box(lat: float, lon: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lon, max_lat, max_lon) enclosing a circle"""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+# ==================== GRID ====================
+
+# About 550 m x 550 m around Paris
+GRID_LAT_DEGREES = 0.005
+GRID_LON_DEGREES = 0.0075
+
+# Cell key = row * _ROW_SPAN + column offset, so the cells of one row are contiguous
+_ROW_SPAN = 1 << 20
+_COL_OFFSET = 1 << 19
+
+
+def grid_cell(lat: float, lon: float) -> int:
+    """Key of the grid cell containing a point"""
+    row = math.floor(lat / GRID_LAT_DEGREES)
+    col = math.floor(lon / GRID_LON_DEGREES)
+    return row * _ROW_SPAN + col + _COL_OFFSET
+
+
+def grid_ranges(lat: float, lon: float, radius_m: float) -> Iterator[Tuple[int, int]]:
+    """(first, last) cell keys of each grid row overlapping a circle"""
+    min_lat, min_lon, max_lat, max_lon = bounding_box(lat, lon, radius_m)
+    first_col = math.floor(min_lon / GRID_LON_DEGREES) + _COL_OFFSET
+    last_col = math.floor(max_lon / GRID_LON_DEGREES) + _COL_OFFSET
+    for row in range(math.floor(min_lat / GRID_LAT_DEGREES), math.floor(max_lat / GRID_LAT_DEGREES) + 1):
+        yield row * _ROW_SPAN + first_col, row * _ROW_SPAN + last_col
+
+
+# ==================== BENCHMARK ====================
+
+def _benchmark(sizes: Sequence[int] = (1000, 10000, 50000), radius_m: float = 1000, repeat: int = 5):
+    """Compare the scalar haversine loop with the batched kernels"""
+    global NUMPY_AVAILABLE
+    rng = random.Random(42)
+    center = (48.8566, 2.3522)
+
+    def best_ms(fn) -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - started)
+        return best * 1000
+
+    print(f"NumPy: {np.__version__ if NUMPY_AVAILABLE else 'not installed'}, radius {radius_m:.0f} m")
+    print(f"{'points':>8} {'scalar loop':>12} {'python':>10} {'numpy':>10} {'numpy dist':>11}")
+    for size in sizes:
+        lats = [center[0] + rng.uniform(-0.15, 0.15) for _ in range(size)]
+        lons = [center[1] + rng.uniform(-0.25, 0.25) for _ in range(size)]
+
+        def scalar():
+            found = [(d, i) for i, (la, lo) in enumerate(zip(lats, lons))
+                     if (d := haversine_distance(center[0], center[1], la, lo)) <= radius_m]
+            found.sort()
+
+        numpy_available = NUMPY_AVAILABLE
+        NUMPY_AVAILABLE = False
+        python_ms = best_ms(lambda: within_radius(center[0], center[1], lats, lons, radius_m))
+        NUMPY_AVAILABLE = numpy_available
+
+        row = f"{size:>8} {best_ms(scalar):>10.2f}ms {python_ms:>8.2f}ms"
+        if NUMPY_AVAILABLE:
+            np_lats, np_lons = np.array(lats), np.array(lons)
+            kernel_ms = best_ms(lambda: within_radius(center[0], center[1], np_lats, np_lons, radius_m))
+            all_ms = best_ms(lambda: distances(center[0], center[1], np_lats, np_lons))
+            row += f" {kernel_ms:>8.2f}ms {all_ms:>9.2f}ms"
+        print(row)
+
+
+if __name__ == "__main__":
+    _benchmark()
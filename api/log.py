@@ -0,0 +1,122 @@
+"""
+Logging for the transit dashboard
+Records go through a queue to a background thread so request handlers never
+block on stdout, repeated messages are sampled, and levels can be changed at
+runtime (see /api/admin/log_level)
+"""
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+ROOT_LOGGER = "transit"
+
+# Loggers for verbose output, off unless switched to DEBUG at runtime
+SIRI_LOGGER = f"{ROOT_LOGGER}.siri"  # One line per parsed visit
+API_LOGGER = f"{ROOT_LOGGER}.api"    # One line per request
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Get a logger below the dashboard root logger"""
+    if name.startswith(ROOT_LOGGER):
+        return logging.getLogger(name)
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through at most `burst` records with the same message template per
+    `window` seconds; the number of dropped records is appended to the next
+    one that gets through. Loggers switched to DEBUG are not sampled, since
+    whoever enabled them wants every record.
+    """
+
+    def __init__(self, burst: int = 5, window: float = 60):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._seen: Dict[Tuple[str, object], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG or logging.getLogger(record.name).getEffectiveLevel() <= logging.DEBUG:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        state = self._seen.get(key)
+
+        if state is None or now - state[0] >= self.window:
+            suppressed = state[2] if state else 0
+            self._seen[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+            return True
+
+        if state[1] < self.burst:
+            state[1] += 1
+            return True
+
+        state[2] += 1
+        return False
+
+
+def setup_logging(level: Optional[str] = None):
+    """
+    Configure the dashboard loggers: a non-blocking queue handler with
+    sampling, drained by a listener thread writing to stdout
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level)
+    root.propagate = False
+
+    # Verbose loggers stay quiet until explicitly enabled
+    logging.getLogger(SIRI_LOGGER).setLevel(logging.INFO)
+    logging.getLogger(API_LOGGER).setLevel(logging.INFO)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)-7s [%(name)s] %(message)s", datefmt="%H:%M:%S"
+    ))
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def set_level(level: str, name: str = ROOT_LOGGER) -> bool:
+    """Change a logger's level at runtime"""
+    level = level.upper()
+    if level not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+        return False
+    get_logger(name).setLevel(level)
+    return True
+
+
+def get_levels() -> Dict[str, str]:
+    """Effective level of the dashboard loggers"""
+    names = [ROOT_LOGGER] + sorted(
+        n for n in logging.root.manager.loggerDict if n.startswith(f"{ROOT_LOGGER}.")
+    )
+    return {n: logging.getLevelName(logging.getLogger(n).getEffectiveLevel()) for n in names}
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from datetime import datetime
 from typing import List, Optional
 
@@ -24,9 +24,13 @@ class StopDepartures(BaseModel):
     departures: List[Departure]
     is_cached: bool = False
     error: Optional[str] = None
+    version: int = 0  # Bumped by the refresh engine whenever the content changes
 
 
 class StopConfig(BaseModel):
+    # Shared by the config snapshots, so never modified in place
+    model_config = ConfigDict(frozen=True)
+    
     id: str  # STIF:StopPoint:Q:XXXXX: or STIF:StopArea:SP:XXXXX:
     name: str
     line: str
@@ -34,6 +38,8 @@ class StopConfig(BaseModel):
     direction: Optional[str] = None
     direction_id: Optional[str] = None
     transport_type: str = "bus"  # bus, rer, metro, tram, train
+    min_refresh_seconds: Optional[int] = None  # Bounds for adaptive refresh scheduling
+    max_refresh_seconds: Optional[int] = None
 
 
 class SearchResult(BaseModel):
@@ -0,0 +1,380 @@
+"""
+Background refresh engine for real-time departures
+Fetches configured stops concurrently with a bounded number of in-flight
+PRIM requests, publishes each result as soon as it lands, and schedules
+each stop's next refresh from its upcoming departures
+"""
+import asyncio
+import heapq
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Any, Set, Tuple
+
+from .client import IDFMClient, PARIS_TZ
+from .config import ConfigManager
+from .log import get_logger
+from .metrics import REFRESH_CYCLE_SECONDS
+from .models import StopConfig, StopDepartures
+
+logger = get_logger("refresh")
+
+
+def stop_key(stop_config: StopConfig) -> str:
+    """Key used to store a stop's departures in the shared data dict"""
+    return f"{stop_config.id}:{stop_config.direction or ''}"
+
+
+def group_by_monitoring_ref(stops: List[StopConfig]) -> List[List[StopConfig]]:
+    """Group stops sharing a MonitoringRef so each group needs a single PRIM call"""
+    groups: Dict[str, List[StopConfig]] = {}
+    for stop_config in stops:
+        groups.setdefault(stop_config.id, []).append(stop_config)
+    return list(groups.values())
+
+
+def next_refresh_delay(stop_config: StopConfig, departures: StopDepartures,
+                       previous: Optional[StopDepartures],
+                       min_delay: float, max_delay: float) -> float:
+    """
+    Seconds until a stop should be refreshed again:
+    - half the time to its soonest departure, so a bus 40 minutes away waits longer
+      than a metro arriving in 2 minutes
+    - longer when only theoretical (non realtime) times are available
+    - shorter when expected times moved since the previous fetch
+    Clamped to the stop's own bounds when set, otherwise to min_delay/max_delay.
+    """
+    if stop_config.min_refresh_seconds:
+        min_delay = max(min_delay, stop_config.min_refresh_seconds)
+    if stop_config.max_refresh_seconds:
+        max_delay = stop_config.max_refresh_seconds
+    max_delay = max(min_delay, max_delay)
+
+    if departures.error or not departures.departures:
+        return max(min_delay, min(max_delay, min_delay * 2))
+
+    soonest = min(d.expected for d in departures.departures)
+    delay = (soonest - departures.last_updated).total_seconds() / 2
+
+    if not any(d.is_realtime for d in departures.departures):
+        delay *= 2
+
+    if previous and previous.departures:
+        previous_expected = {(d.line_id, d.scheduled): d.expected for d in previous.departures}
+        shifts = [
+            abs((d.expected - previous_expected[(d.line_id, d.scheduled)]).total_seconds())
+            for d in departures.departures
+            if (d.line_id, d.scheduled) in previous_expected
+        ]
+        if shifts and sum(shifts) / len(shifts) >= 60:
+            delay /= 2
+
+    return max(min_delay, min(max_delay, delay))
+
+
+class RefreshEngine:
+    """
+    Refreshes configured stops in parallel, each on its own schedule.
+    Stops sharing a MonitoringRef are scheduled together since one request serves them all.
+    Follows config changes as they happen: added stops are fetched right away
+    and removed ones forgotten, without disturbing the schedule of the others.
+    """
+
+    # Longest sleep between schedule checks, so new stops are picked up quickly
+    POLL_SECONDS = 5
+
+    def __init__(self, config_manager: ConfigManager,
+                 get_client: Callable[[], Optional[IDFMClient]],
+                 store: Dict[str, StopDepartures],
+                 on_update: Optional[Callable[[List[str]], None]] = None):
+        self.config = config_manager
+        self.get_client = get_client
+        self.store = store
+        self.on_update = on_update
+        # Monotonic version stamped on stop data when it changes; the epoch tells
+        # clients whether versions come from this process (random, so workers
+        # started in the same second don't share one)
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.last_cycle: Dict[str, Any] = {}
+        self.stop_latency_ms: Dict[str, float] = {}
+        self.effective_interval: float = config_manager.refresh_interval
+        # Priority queue of (due time, monitoring ref), with lazy deletion through _due
+        self._queue: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        # Groups being fetched outside the refresh loop, and those fetches
+        self._inflight: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._running = False
+        # Bumped on every config change, so fetches started before a stop was
+        # removed don't publish or reschedule it once they land
+        self._generation = 0
+        self._configured: Tuple[int, Set[str], Set[str]] = (-1, set(), set())
+        # Caps PRIM requests in flight across the loop and add-stop fetches
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_size = 0
+        config_manager.on_stops_change.append(self.stops_changed)
+
+    def schedule(self, monitoring_ref: str, due: float):
+        """Set when a group of stops should next be refreshed"""
+        self._due[monitoring_ref] = due
+        heapq.heappush(self._queue, (due, monitoring_ref))
+
+    def _pop_due(self, now: float) -> List[str]:
+        refs = []
+        while self._queue and self._queue[0][0] <= now:
+            due, monitoring_ref = heapq.heappop(self._queue)
+            if self._due.get(monitoring_ref) == due:
+                del self._due[monitoring_ref]
+                refs.append(monitoring_ref)
+        return refs
+
+    def _next_due(self) -> Optional[float]:
+        while self._queue and self._due.get(self._queue[0][1]) != self._queue[0][0]:
+            heapq.heappop(self._queue)
+        return self._queue[0][0] if self._queue else None
+
+    def _configured_stops(self) -> Tuple[Set[str], Set[str]]:
+        """Stop keys and monitoring refs currently configured, rebuilt after each config change"""
+        generation, keys, refs = self._configured
+        if generation != self._generation:
+            stops = self.config.stops
+            keys = {stop_key(s) for s in stops}
+            refs = {s.id for s in stops}
+            self._configured = (self._generation, keys, refs)
+        return keys, refs
+
+    def _request_slots(self) -> asyncio.Semaphore:
+        """Engine-wide semaphore, resized when max_concurrent_requests changes"""
+        size = max(1, self.config.max_concurrent_requests)
+        if self._semaphore is None or size != self._semaphore_size:
+            self._semaphore = asyncio.Semaphore(size)
+            self._semaphore_size = size
+        return self._semaphore
+
+    # ==================== CONFIG CHANGES ====================
+
+    def stops_changed(self, added: Tuple[StopConfig, ...], removed: Tuple[StopConfig, ...]):
+        """Config listener: drop the data of removed stops, fetch added ones now"""
+        self._generation += 1
+        for stop_config in removed:
+            key = stop_key(stop_config)
+            self.store.pop(key, None)
+            self.stop_latency_ms.pop(key, None)
+        if removed:
+            configured_refs = {s.id for s in self.config.stops}
+            for monitoring_ref in {s.id for s in removed} - configured_refs:
+                self._due.pop(monitoring_ref, None)
+        if not added:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        client = self.get_client()
+        if not self._running or client is None or loop is None:
+            # Picked up by the refresh loop once it runs
+            now = time.monotonic()
+            for monitoring_ref in {s.id for s in added}:
+                self.schedule(monitoring_ref, now)
+            return
+
+        # Groups the loop doesn't know yet are left to this fetch, which schedules them
+        new_refs = {s.id for s in added} - self._due.keys() - self._inflight
+        self._inflight |= new_refs
+        task = loop.create_task(self._fetch_added(client, list(added), new_refs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch_added(self, client: IDFMClient, added: List[StopConfig], new_refs: Set[str]):
+        """
+        Fetch newly configured stops. Stops joining a known group only get
+        their data; new groups are also scheduled from it.
+        """
+        try:
+            configured = set(self.config.stops)
+            added = [s for s in added if s in configured]
+            new_groups = [g for g in group_by_monitoring_ref(added) if g[0].id in new_refs]
+            joining = [s for s in added if s.id not in new_refs]
+            await asyncio.gather(
+                self.refresh_due(client, new_groups) if new_groups else asyncio.sleep(0),
+                self.refresh_cycle(client, joining) if joining else asyncio.sleep(0),
+            )
+        finally:
+            self._inflight -= new_refs
+
+    # ==================== REFRESH LOOP ====================
+
+    async def run(self):
+        """Refresh loop, meant to run as a background task"""
+        logger.info("Background task started")
+        self._running = True
+        self._semaphore = None  # bound to this loop on first use
+        try:
+            await self._run()
+        finally:
+            self._running = False
+            for task in list(self._tasks):
+                task.cancel()
+
+    async def _run(self):
+        while True:
+            client = self.get_client()
+            stops = self.config.stops
+            sleep_for = self.POLL_SECONDS
+
+            if client and stops:
+                groups = {g[0].id: g for g in group_by_monitoring_ref(stops)}
+
+                # New groups are due immediately, removed ones are forgotten
+                now = time.monotonic()
+                for monitoring_ref in groups:
+                    if monitoring_ref not in self._due and monitoring_ref not in self._inflight:
+                        self.schedule(monitoring_ref, now)
+                for monitoring_ref in list(self._due):
+                    if monitoring_ref not in groups:
+                        del self._due[monitoring_ref]
+
+                blocked_for = client.rate_budget.blocked_for()
+                if blocked_for > 0:
+                    logger.warning("Rate limited by PRIM, pausing %.0fs", blocked_for)
+                    sleep_for = blocked_for
+                else:
+                    due_refs = [r for r in self._pop_due(now) if r in groups]
+                    if due_refs:
+                        await self.refresh_due(client, [groups[r] for r in due_refs])
+
+                    next_due = self._next_due()
+                    if next_due is not None:
+                        sleep_for = min(self.POLL_SECONDS, max(0, next_due - time.monotonic()))
+            else:
+                logger.info("Waiting... client=%s, stops=%d", client is not None, len(stops))
+
+            await asyncio.sleep(sleep_for)
+
+    async def refresh_due(self, client: IDFMClient, groups: List[List[StopConfig]]):
+        """Refresh the given groups and schedule their next refresh from the new data"""
+        stops = [s for g in groups for s in g]
+        previous = {stop_key(s): self.store.get(stop_key(s)) for s in stops}
+
+        await self.refresh_cycle(client, stops)
+
+        # The daily budget sets a floor on how often any group may be refreshed
+        total_groups = len(self._due) + len(groups)
+        min_delay = client.rate_budget.effective_interval(total_groups, self.config.refresh_interval)
+        max_delay = max(min_delay, self.config.max_refresh_interval)
+        self.effective_interval = min_delay
+
+        # Groups removed from the config while being fetched are not rescheduled
+        _, configured_refs = self._configured_stops()
+        now = time.monotonic()
+        for group in groups:
+            if group[0].id not in configured_refs:
+                continue
+            delays = [
+                next_refresh_delay(s, self.store[stop_key(s)], previous[stop_key(s)], min_delay, max_delay)
+                for s in group if stop_key(s) in self.store
+            ]
+            self.schedule(group[0].id, now + (min(delays) if delays else min_delay))
+
+    async def refresh_cycle(self, client: IDFMClient, stops: List[StopConfig]):
+        """Fetch the given stops once, publishing results to the store as they arrive"""
+        semaphore = self._request_slots()
+        stop_timeout = self.config.stop_timeout
+        errors = 0
+        changed: List[str] = []
+
+        async def fetch_group(group: List[StopConfig]):
+            nonlocal errors
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    results = await asyncio.wait_for(
+                        client.get_departures_group(group), timeout=stop_timeout
+                    )
+                except asyncio.TimeoutError:
+                    results = [self._stale_or_error(s, "Timeout") for s in group]
+                except Exception as e:
+                    results = [self._stale_or_error(s, str(e)) for s in group]
+                latency_ms = round((time.monotonic() - started) * 1000, 1)
+
+            # Stops removed from the config while their request was in flight are dropped
+            configured_keys, _ = self._configured_stops()
+            for stop_config, departures in zip(group, results):
+                key = stop_key(stop_config)
+                if key not in configured_keys:
+                    continue
+                if departures.error:
+                    errors += 1
+                self.stop_latency_ms[key] = latency_ms
+                if self._publish(key, departures):
+                    changed.append(key)
+
+        groups = group_by_monitoring_ref(stops)
+        cycle_start = time.monotonic()
+        tasks = [asyncio.create_task(fetch_group(g)) for g in groups]
+        done, pending = await asyncio.wait(tasks, timeout=self.config.cycle_deadline)
+
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        duration_ms = round((time.monotonic() - cycle_start) * 1000, 1)
+        REFRESH_CYCLE_SECONDS.observe(duration_ms / 1000)
+        self.last_cycle = {
+            "finished_at": datetime.now(PARIS_TZ).isoformat(),
+            "duration_ms": duration_ms,
+            "stops": len(stops),
+            "requests": len(groups),
+            "errors": errors,
+            "deadline_exceeded": len(pending),
+        }
+        if changed and self.on_update:
+            self.on_update(changed)
+
+        logger.info("Refreshed %d stops with %d/%d requests in %.0f ms (%d errors, %d over deadline)",
+                    len(stops), len(done), len(groups), duration_ms, errors, len(pending))
+
+    def _publish(self, key: str, departures: StopDepartures) -> bool:
+        """Store a stop's data, bumping its version if the content changed"""
+        previous = self.store.get(key)
+        unchanged = (
+            previous is not None
+            and previous.departures == departures.departures
+            and previous.error == departures.error
+            and previous.is_cached == departures.is_cached
+        )
+        if unchanged:
+            departures.version = previous.version
+        else:
+            self.version += 1
+            departures.version = self.version
+        self.store[key] = departures
+        return not unchanged
+
+    def _stale_or_error(self, stop_config: StopConfig, error: str) -> StopDepartures:
+        """Keep the previous data marked as cached, or report the error"""
+        previous = self.store.get(stop_key(stop_config))
+        if previous and not previous.error:
+            return previous.model_copy(update={"is_cached": True})
+        return StopDepartures(
+            stop_id=stop_config.id, stop_name=stop_config.name,
+            line=stop_config.line, line_id=stop_config.line_id,
+            direction=stop_config.direction, last_updated=datetime.now(PARIS_TZ),
+            departures=[], error=error
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Timing of the last cycle, per-stop latency and refresh schedule"""
+        now = time.monotonic()
+        return {
+            "last_cycle": self.last_cycle,
+            "effective_interval_seconds": round(self.effective_interval, 1),
+            "stop_latency_ms": dict(self.stop_latency_ms),
+            "next_refresh_in_seconds": {
+                monitoring_ref: round(max(0, due - now), 1)
+                for monitoring_ref, due in self._due.items()
+            },
+        }
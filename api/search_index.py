@@ -0,0 +1,544 @@
+"""
+Local stop search index
+Terms are accent-folded when the index is built, and an inverted n-gram
+index maps trigrams (and 2-letter word prefixes) to terms, so a substring
+query is answered with a few set intersections instead of a full scan.
+Stops with known coordinates are also bucketed on a fixed lat/lon grid
+(see geo) for nearby-stop lookups, and the lines serving each stop form a
+catalogue that can be read both ways (stop -> lines, line -> stops).
+At runtime the index is a set of flat arrays (see binary_index), usually
+memory-mapped from data/search_index.bin.
+"""
+import json
+import math
+import os
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .binary_index import MappedIndex, Section, StringTable, bisect_strings
+from .geo import grid_cell, grid_ranges, within_radius
+from .log import get_logger
+
+NGRAM_SIZE = 3
+
+# Open Data mode names, for lines indexed without one
+MODE_NAMES = {
+    "metro": "Metro",
+    "rer": "RapidTransit",
+    "train": "LocalTrain",
+    "tram": "Tram",
+    "bus": "Bus",
+}
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../data')
+
+# Index files in order of preference
+INDEX_PATHS = (
+    os.path.join(DATA_DIR, 'search_index.bin'),
+    os.path.join(DATA_DIR, 'search_index.json'),
+)
+
+logger = get_logger("search_index")
+
+
+def normalize_text(text: str) -> str:
+    """Remove accents and lowercase text for search"""
+    # Normalize to NFD (decompose accents)
+    nfd = unicodedata.normalize('NFD', text)
+    # Remove accent marks (category Mn = Mark, Nonspacing)
+    without_accents = ''.join(c for c in nfd if unicodedata.category(c) != 'Mn')
+    return without_accents.lower().strip()
+
+
+def ngrams(text: str, n: int = NGRAM_SIZE) -> Set[str]:
+    """All substrings of length n"""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def word_prefixes(text: str, n: int = NGRAM_SIZE - 1) -> Set[str]:
+    """Prefixes of length n of each word, used for queries shorter than an n-gram"""
+    return {word[:n] for word in text.replace('-', ' ').split() if len(word) >= n}
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Edit distance counting insertions, deletions, substitutions and swaps of
+    adjacent letters; stops early and returns max_distance + 1 once the
+    distance is known to exceed max_distance
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def build_term_index(search_terms: Dict[str, Iterable[str]]) -> Dict:
+    """
+    Build the inverted index over normalized search terms:
+        {
+            "terms": ["joinville", ...],                # sorted, position = term id
+            "ngrams": {"joi": [0, ...], ...},           # trigram -> term ids
+            "prefixes": {"jo": [0, ...], ...}           # word prefix -> term ids
+        }
+    """
+    terms = sorted(search_terms)
+    gram_index: Dict[str, List[int]] = {}
+    prefix_index: Dict[str, List[int]] = {}
+
+    for term_id, term in enumerate(terms):
+        for gram in ngrams(term):
+            gram_index.setdefault(gram, []).append(term_id)
+        for prefix in word_prefixes(term):
+            prefix_index.setdefault(prefix, []).append(term_id)
+
+    return {"terms": terms, "ngrams": gram_index, "prefixes": prefix_index}
+
+
+def _csr(lists: List[List[int]]) -> Tuple[array, array]:
+    """Pack a list of int lists as (offsets, flat values)"""
+    offsets = array("I", [0])
+    flat = array("I")
+    for values in lists:
+        flat.extend(values)
+        offsets.append(len(flat))
+    return offsets, flat
+
+
+def compile_index(data: Dict) -> Dict[str, Section]:
+    """
+    Convert the JSON form of the index (see build_search_index) into flat
+    arrays: interned strings, integer stop/line ids and CSR posting lists.
+    Every "*_str"/"*_id" key array is sorted by string value for lookups.
+    """
+    stops_data: Dict[str, Dict] = data.get("stops", {})
+    search_terms: Dict[str, List[str]] = data.get("search_terms", {})
+
+    if "ngrams" not in data:
+        # Index built by an older version: fold terms and build the n-grams now
+        folded: Dict[str, Set[str]] = {}
+        for term, ids in search_terms.items():
+            if isinstance(term, str):
+                folded.setdefault(normalize_text(term), set()).update(ids)
+        search_terms = {term: sorted(ids) for term, ids in folded.items()}
+        data = build_term_index(search_terms)
+
+    strings: List[str] = []
+    string_ids: Dict[str, int] = {}
+
+    def intern(value: str) -> int:
+        sid = string_ids.get(value)
+        if sid is None:
+            sid = string_ids[value] = len(strings)
+            strings.append(value)
+        return sid
+
+    # Stops, sorted by id
+    stop_ids = sorted(stops_data)
+    stop_pos = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+    line_pos: Dict[Tuple[str, ...], int] = {}
+    line_keys: List[Tuple[str, ...]] = []
+    stop_lines: List[List[int]] = []
+    line_stops: List[List[int]] = []
+    for pos, stop_id in enumerate(stop_ids):
+        positions = []
+        for line in stops_data[stop_id].get("lines", []):
+            transport_type = line["transport_type"]
+            key = (line["line_id"], line["line_name"], transport_type,
+                   line.get("mode") or MODE_NAMES.get(transport_type, "Bus"), line.get("operator", ""))
+            if key not in line_pos:
+                line_pos[key] = len(line_keys)
+                line_keys.append(key)
+                line_stops.append([])
+            positions.append(line_pos[key])
+            line_stops[line_pos[key]].append(pos)
+        stop_lines.append(positions)
+
+    sections: Dict[str, Section] = {
+        "stop_id": array("I", (intern(i) for i in stop_ids)),
+        "stop_name": array("I", (intern(stops_data[i]["name"]) for i in stop_ids)),
+        "stop_norm": array("I", (
+            intern(stops_data[i].get("norm_name") or normalize_text(stops_data[i]["name"])) for i in stop_ids
+        )),
+        "line_id": array("I", (intern(k[0]) for k in line_keys)),
+        "line_name": array("I", (intern(k[1]) for k in line_keys)),
+        "line_type": array("I", (intern(k[2]) for k in line_keys)),
+        "line_mode": array("I", (intern(k[3]) for k in line_keys)),
+        "line_operator": array("I", (intern(k[4]) for k in line_keys)),
+    }
+    # Line catalogue, both ways: stop -> lines and line -> stops
+    sections["stop_lines_off"], sections["stop_lines"] = _csr(stop_lines)
+    sections["line_stops_off"], sections["line_stops"] = _csr(line_stops)
+
+    # Coordinates (NaN when unknown) and the grid buckets of located stops
+    nan = float("nan")
+    locations = [stops_data[i].get("location") or {} for i in stop_ids]
+    sections["stop_lat"] = array("d", (loc.get("lat", nan) for loc in locations))
+    sections["stop_lon"] = array("d", (loc.get("lon", nan) for loc in locations))
+    cells: Dict[int, List[int]] = {}
+    for pos, loc in enumerate(locations):
+        if "lat" in loc and "lon" in loc:
+            cells.setdefault(grid_cell(loc["lat"], loc["lon"]), []).append(pos)
+    cell_keys = sorted(cells)
+    sections["grid_cells"] = array("q", cell_keys)
+    sections["grid_stops_off"], sections["grid_stops"] = _csr([cells[k] for k in cell_keys])
+
+    # Terms keep their sorted order, so n-gram postings (term positions) stay valid
+    terms = data["terms"]
+    sections["term_str"] = array("I", (intern(t) for t in terms))
+    sections["term_stops_off"], sections["term_stops"] = _csr([
+        sorted(stop_pos[i] for i in search_terms.get(t, ()) if i in stop_pos) for t in terms
+    ])
+
+    for name, index in (("gram", data["ngrams"]), ("prefix", data["prefixes"])):
+        keys = sorted(index)
+        sections[f"{name}_str"] = array("I", (intern(k) for k in keys))
+        sections[f"{name}_terms_off"], sections[f"{name}_terms"] = _csr([index[k] for k in keys])
+
+    table = StringTable.build(strings)
+    sections["str_offsets"] = table["offsets"]
+    sections["str_blob"] = table["blob"]
+    return sections
+
+
+def _lines_by_name(index: "SearchIndex") -> Dict[str, List[int]]:
+    by_name: Dict[str, List[int]] = {}
+    for i, sid in enumerate(index.line_name):
+        by_name.setdefault(normalize_text(index.strings[sid]), []).append(i)
+    return by_name
+
+
+class SearchIndex:
+    """
+    Read-only search index over flat arrays, either memory-mapped from the
+    binary file or compiled in memory from the JSON form
+    """
+
+    def __init__(self, sections: Optional[Dict[str, Sequence]] = None, meta: Optional[Dict] = None,
+                 mapped: Optional[MappedIndex] = None):
+        self._sections = sections if sections is not None else compile_index({})
+        self.meta = meta or {}
+        # Keeps the mmap alive as long as the index is used
+        self._mapped = mapped
+        self.strings = StringTable(self._sections["str_offsets"], self._sections["str_blob"])
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "SearchIndex":
+        return cls(compile_index(data))
+
+    @classmethod
+    def load(cls, path: str) -> "SearchIndex":
+        """Open a binary index with mmap, or compile a JSON one"""
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        mapped = MappedIndex(path)
+        return cls(mapped.sections, mapped.meta, mapped)
+
+    def __getattr__(self, name: str):
+        # Sections are exposed as attributes, e.g. self.stop_name
+        try:
+            return self.__dict__["_sections"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __bool__(self) -> bool:
+        return len(self.term_str) > 0
+
+    def __len__(self) -> int:
+        """Number of stops"""
+        return len(self.stop_id)
+
+    # ==================== LOOKUPS ====================
+
+    def _posting(self, section: str, i: int) -> Sequence[int]:
+        offsets = self._sections[f"{section}_off"]
+        return self._sections[section][offsets[i]:offsets[i + 1]]
+
+    def _find(self, keys: str, value: str) -> int:
+        return bisect_strings(self.strings, self._sections[keys], value)
+
+    def stop_index(self, stop_id: str) -> int:
+        """Position of a stop id, or -1"""
+        return self._find("stop_id", stop_id)
+
+    def stop(self, i: int) -> Dict:
+        """Stop record in the same shape as the JSON index"""
+        strings = self.strings
+        return {
+            "id": strings[self.stop_id[i]],
+            "name": strings[self.stop_name[i]],
+            "norm_name": strings[self.stop_norm[i]],
+            "lines": [self.line(l) for l in self._posting("stop_lines", i)],
+            "location": self.location(i),
+        }
+
+    @property
+    def has_locations(self) -> bool:
+        """Whether stops carry coordinates (indexes built before they were added don't)"""
+        return len(self._sections.get("grid_cells", ())) > 0
+
+    def location(self, i: int) -> Optional[Dict[str, float]]:
+        if not self.has_locations or math.isnan(self.stop_lat[i]):
+            return None
+        return {"lat": self.stop_lat[i], "lon": self.stop_lon[i]}
+
+    def stops_near(self, lat: float, lon: float, radius_m: float) -> List[Tuple[float, int]]:
+        """(distance in metres, stop position) of the stops within radius_m, nearest first"""
+        if not self.has_locations:
+            return []
+        cells = self.grid_cells
+        candidates: List[int] = []
+        for first, last in grid_ranges(lat, lon, radius_m):
+            # Cells of a grid row are contiguous in the sorted keys
+            for cell in range(bisect_left(cells, first), bisect_right(cells, last)):
+                candidates.extend(self._posting("grid_stops", cell))
+        return within_radius(lat, lon, self.stop_lat, self.stop_lon, radius_m, subset=candidates)
+
+    def line(self, i: int) -> Dict:
+        strings = self.strings
+        line = {
+            "line_id": strings[self.line_id[i]],
+            "line_name": strings[self.line_name[i]],
+            "transport_type": strings[self.line_type[i]],
+        }
+        if self.has_catalogue:
+            line["mode"] = strings[self.line_mode[i]]
+            line["operator"] = strings[self.line_operator[i]]
+        return line
+
+    # ==================== LINE CATALOGUE ====================
+
+    @property
+    def has_catalogue(self) -> bool:
+        """Whether the line -> stops catalogue is present (indexes built before it was added lack it)"""
+        return "line_stops" in self._sections
+
+    def line_stop_positions(self, i: int) -> Sequence[int]:
+        """Positions of the stops served by a line"""
+        return self._posting("line_stops", i)
+
+    def find_lines(self, name: str) -> List[int]:
+        """Positions of the lines with this name (case and accent insensitive)"""
+        by_name = self.cached("lines_by_name", _lines_by_name)
+        return by_name.get(normalize_text(name), [])
+
+    def _candidate_terms(self, query: str) -> Set[int]:
+        if len(query) < NGRAM_SIZE:
+            pos = self._find("prefix_str", query)
+            return set(self._posting("prefix_terms", pos)) if pos >= 0 else set()
+
+        postings = []
+        for gram in ngrams(query):
+            pos = self._find("gram_str", gram)
+            if pos < 0:
+                return set()
+            postings.append(self._posting("gram_terms", pos))
+
+        # Intersect from the rarest gram up
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return candidates
+
+    def find_term(self, term: str) -> int:
+        """Position of a search term, or -1"""
+        return self._find("term_str", term)
+
+    def term(self, i: int) -> str:
+        return self.strings[self.term_str[i]]
+
+    def term_stops(self, i: int) -> Sequence[int]:
+        """Positions of the stops indexed under a term"""
+        return self._posting("term_stops", i)
+
+    def stop_line_positions(self, i: int) -> Sequence[int]:
+        return self._posting("stop_lines", i)
+
+    def cached(self, name: str, build: Callable[["SearchIndex"], Any]) -> Any:
+        """Value derived from the index, built on first use and kept with it"""
+        derived = self.__dict__.setdefault("_derived", {})
+        if name not in derived:
+            derived[name] = build(self)
+        return derived[name]
+
+    def line_types(self) -> List[str]:
+        """Transport type of each line, decoded once"""
+        return self.cached("line_types", lambda index: [index.strings[t] for t in index.line_type])
+
+    def containing_terms(self, query_normalized: str) -> List[int]:
+        """Positions of the terms containing the (already normalized) query"""
+        return [
+            term_id for term_id in self._candidate_terms(query_normalized)
+            # Shared n-grams don't guarantee a substring match
+            if query_normalized in self.strings[self.term_str[term_id]]
+        ]
+
+    def similar_terms(self, token: str, max_distance: int) -> Dict[int, int]:
+        """
+        Terms within max_distance edits of a token, with their distance.
+        Each edit changes at most NGRAM_SIZE n-grams, so candidates are the
+        terms sharing enough of the token's n-grams.
+        """
+        grams = ngrams(token)
+        required = max(1, len(grams) - NGRAM_SIZE * max_distance)
+
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            pos = self._find("gram_str", gram)
+            if pos >= 0:
+                for term_id in self._posting("gram_terms", pos):
+                    shared[term_id] = shared.get(term_id, 0) + 1
+
+        similar = {}
+        for term_id, count in shared.items():
+            if count < required:
+                continue
+            term = self.strings[self.term_str[term_id]]
+            if abs(len(term) - len(token)) > max_distance:
+                continue
+            distance = edit_distance(token, term, max_distance)
+            if distance <= max_distance:
+                similar[term_id] = distance
+        return similar
+
+    def find_stops(self, query_normalized: str) -> Set[int]:
+        """Positions of stops with a search term containing the (already normalized) query"""
+        stops: Set[int] = set()
+        for term_id in self.containing_terms(query_normalized):
+            stops.update(self._posting("term_stops", term_id))
+        return stops
+
+
+class SharedSearchIndex:
+    """
+    Process-wide search index shared by every IDFMClient.
+    Loaded lazily on first use; afterwards the index file is checked at most
+    every CHECK_INTERVAL seconds and, when a rebuilt file appears, the new
+    index is loaded in a background thread and swapped in atomically.
+    Callers keep using the current index while a reload is in progress.
+    """
+
+    CHECK_INTERVAL = 30
+
+    def __init__(self, paths: Sequence[str] = INDEX_PATHS):
+        self.paths = tuple(paths)
+        self.path: Optional[str] = None
+        self.loaded_at: Optional[float] = None
+        self._index: Optional[SearchIndex] = None
+        self._signature: Optional[Tuple] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._reloading = False
+        # Called with each newly loaded index before it is swapped in,
+        # to precompute derived data off the request path
+        self.on_load: List[Callable[[SearchIndex], None]] = []
+
+    def _file_signatures(self) -> Tuple[Optional[Tuple], ...]:
+        """Identity of each candidate index file (None when missing), to notice rebuilds"""
+        signatures = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                signatures.append(None)
+                continue
+            signatures.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        return tuple(signatures)
+
+    def _load(self):
+        # Taken before loading: a file replaced meanwhile is picked up at the next check
+        signatures = self._file_signatures()
+        index = None
+        for candidate, signature in zip(self.paths, signatures):
+            if signature is None:
+                continue
+            try:
+                started = time.perf_counter()
+                index = SearchIndex.load(candidate)
+                for hook in self.on_load:
+                    hook(index)
+                logger.info("Loaded search index %s (%d stops) in %.1f ms",
+                            candidate, len(index), (time.perf_counter() - started) * 1000)
+                break
+            except Exception as e:
+                index = None
+                logger.warning("Could not load search index %s: %s", candidate, e)
+
+        if index is not None:
+            self.path, self._signature = candidate, signatures
+        elif not any(signatures):
+            logger.warning("Could not load search index: no index file in %s", DATA_DIR)
+            self.path, self._signature = None, signatures
+        # Otherwise the signatures are left as they were, so the files are retried
+
+        if index is None:
+            # Keep serving the previous index rather than an empty one
+            index = self._index if self._index is not None else SearchIndex()
+
+        # Swapping the reference is atomic: readers see the old or the new index
+        self._index = index
+        self.loaded_at = time.time()
+
+    def _reload_in_background(self):
+        try:
+            self._load()
+        finally:
+            self._reloading = False
+
+    def get(self) -> SearchIndex:
+        """Current index, loading it on first use"""
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._load()
+                    self._last_check = time.monotonic()
+            return self._index
+
+        now = time.monotonic()
+        if now - self._last_check >= self.CHECK_INTERVAL and not self._reloading:
+            self._last_check = now
+            if self._file_signatures() != self._signature:
+                with self._lock:
+                    if not self._reloading:
+                        self._reloading = True
+                        threading.Thread(target=self._reload_in_background,
+                                         name="search-index-reload", daemon=True).start()
+        return self._index
+
+    def warm(self):
+        """Load the index ahead of the first search (blocking, run it off the event loop)"""
+        self.get()
+
+    def info(self) -> Dict:
+        index = self._index
+        return {
+            "path": self.path,
+            "stops": len(index) if index is not None else 0,
+            "loaded_at": self.loaded_at,
+        }
+
+
+shared_search_index = SharedSearchIndex()
+
+
+def get_search_index() -> SearchIndex:
+    """The process-wide search index"""
+    return shared_search_index.get()
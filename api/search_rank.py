@@ -0,0 +1,165 @@
+"""
+Ranking of stop search results
+Each query token is matched against the indexed terms: exactly, as a word
+prefix, as a substring, or within a few typos (see SearchIndex.similar_terms).
+Stops are scored on how well they cover the query, boosted by whole-name
+matches, their transport modes and how many lines serve them, and only the
+best `limit` are kept with a heap, so the cost of building results does
+not grow with the number of matches.
+"""
+import heapq
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .search_index import SearchIndex, normalize_text, shared_search_index
+
+# Match quality of a query token against a term
+EXACT = 1.0
+WORD_PREFIX = 0.9
+SUBSTRING = 0.6
+TYPO = (0.75, 0.55)  # 1 and 2 edits
+
+# Score weights
+COVERAGE_WEIGHT = 100
+EXACT_NAME_BONUS = 40
+NAME_PREFIX_BONUS = 20
+PHRASE_BONUS = 10
+POPULARITY_WEIGHT = 4
+NAME_LENGTH_PENALTY = 10
+
+# Stations of heavy modes are searched far more often than bus stops
+MODE_BOOST = {"rer": 8, "train": 8, "metro": 6, "tram": 4, "bus": 0}
+
+# Tokens too short to be significant alone ("de", "la", ...)
+SHORT_TOKEN = 3
+SHORT_TOKEN_WEIGHT = 0.25
+
+_TOKEN_SPLIT = re.compile(r"[\s\-'’]+")
+
+
+def tokenize(query_normalized: str) -> List[str]:
+    """Distinct words of a normalized query, in order"""
+    return list(dict.fromkeys(t for t in _TOKEN_SPLIT.split(query_normalized) if t))
+
+
+def max_typos(token: str) -> int:
+    """Edits tolerated for a token, depending on its length"""
+    if len(token) < 4:
+        return 0
+    if len(token) < 8:
+        return 1
+    return 2
+
+
+def _term_quality(token: str, term: str) -> float:
+    if term == token:
+        return EXACT
+    if term.startswith(token) or f" {token}" in term or f"-{token}" in term:
+        return WORD_PREFIX
+    return SUBSTRING
+
+
+def match_token(index: SearchIndex, token: str) -> Dict[int, float]:
+    """Best match quality of a token for each stop it matches"""
+    qualities: Dict[int, float] = {}
+
+    def add(term_id: int, quality: float):
+        for stop_pos in index.term_stops(term_id):
+            if qualities.get(stop_pos, 0) < quality:
+                qualities[stop_pos] = quality
+
+    for term_id in index.containing_terms(token):
+        add(term_id, _term_quality(token, index.term(term_id)))
+
+    typos = max_typos(token)
+    if typos:
+        for term_id, distance in index.similar_terms(token, typos).items():
+            if distance:
+                add(term_id, TYPO[distance - 1])
+    return qualities
+
+
+def _stop_features(index: SearchIndex) -> Tuple[List[float], List[frozenset], List[int]]:
+    """Per stop: mode and popularity boost, transport types and name length"""
+    line_types = index.line_types()
+    offsets = index.strings.offsets
+    boosts, types, name_lengths = [], [], []
+    for stop_pos in range(len(index)):
+        positions = index.stop_line_positions(stop_pos)
+        stop_types = frozenset(line_types[l] for l in positions)
+        mode = max((MODE_BOOST.get(t, 0) for t in stop_types), default=0)
+        boosts.append(mode + POPULARITY_WEIGHT * math.log1p(len(positions)))
+        types.append(stop_types)
+        # Byte length of the normalized name, close enough to its length
+        sid = index.stop_norm[stop_pos]
+        name_lengths.append(offsets[sid + 1] - offsets[sid])
+    return boosts, types, name_lengths
+
+
+def prepare(index: SearchIndex):
+    """Precompute the per-stop ranking features of an index"""
+    index.cached("rank_features", _stop_features)
+
+
+shared_search_index.on_load.append(prepare)
+
+
+def rank_stops(index: SearchIndex, query: str, limit: int = 30,
+               transport_type: Optional[str] = None) -> List[Tuple[float, int]]:
+    """(score, stop position) of the best matching stops, best first"""
+    query_normalized = normalize_text(query)
+    tokens = tokenize(query_normalized)
+    if not tokens or not index:
+        return []
+
+    weights = [1.0 if len(t) >= SHORT_TOKEN else SHORT_TOKEN_WEIGHT for t in tokens]
+    matches = [match_token(index, t) for t in tokens]
+
+    # Short tokens only refine the ranking, unless the query has nothing else
+    significant = [m for m, w in zip(matches, weights) if w == 1.0] or matches
+    candidates = set().union(*significant)
+    if not candidates:
+        return []
+
+    # Whole query against full stop names
+    phrase_stops = set()
+    exact_stops = set()
+    prefix_stops = set()
+    if len(tokens) > 1 or len(query_normalized) >= SHORT_TOKEN:
+        for term_id in index.containing_terms(query_normalized):
+            term = index.term(term_id)
+            term_str = index.term_str[term_id]
+            for stop_pos in index.term_stops(term_id):
+                if index.stop_norm[stop_pos] != term_str:
+                    continue
+                phrase_stops.add(stop_pos)
+                if term == query_normalized:
+                    exact_stops.add(stop_pos)
+                elif term.startswith(query_normalized):
+                    prefix_stops.add(stop_pos)
+
+    boosts, types, name_lengths = index.cached("rank_features", _stop_features)
+    total_weight = sum(weights)
+    query_length = len(query_normalized)
+
+    def scored():
+        for stop_pos in candidates:
+            if transport_type and transport_type not in types[stop_pos]:
+                continue
+            coverage = sum(w * m.get(stop_pos, 0) for m, w in zip(matches, weights)) / total_weight
+            score = COVERAGE_WEIGHT * coverage + boosts[stop_pos]
+            if stop_pos in exact_stops:
+                score += EXACT_NAME_BONUS
+            elif stop_pos in prefix_stops:
+                score += NAME_PREFIX_BONUS
+            elif stop_pos in phrase_stops:
+                score += PHRASE_BONUS
+            # Prefer names the query covers most of ("Châtelet" over "Champs Châtelet")
+            name_length = name_lengths[stop_pos]
+            if name_length > query_length:
+                score -= NAME_LENGTH_PENALTY * (name_length - query_length) / name_length
+            # Ties go to the lowest position, i.e. the smallest stop id
+            yield score, -stop_pos
+
+    return [(score, -neg_pos) for score, neg_pos in heapq.nlargest(limit, scored())]
@@ -0,0 +1,307 @@
+"""
+Fast decoder for SIRI StopMonitoring responses
+A response is decoded once (with orjson when installed) into lightweight
+Visit records holding the raw fields; each stop sharing the response then
+filters them, keeps the next departures with a partial sort and only those
+are converted to pydantic Departure models. Timestamps repeat across
+visits and refreshes, so their parsing is cached.
+Large responses can also be decoded while they download: VisitScanner cuts
+each MonitoredStopVisit out of the body chunks and decodes it on its own,
+so memory does not grow with the number of visits.
+"""
+import codecs
+import heapq
+import json
+import logging
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Iterable, List, Optional, Sequence
+
+import pytz
+
+from .log import SIRI_LOGGER, get_logger
+from .models import Departure, StopConfig
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard json module is used instead
+    orjson = None
+
+siri_logger = get_logger(SIRI_LOGGER)
+
+# Paris timezone
+PARIS_TZ = pytz.timezone('Europe/Paris')
+
+# Departures kept per stop
+DEPARTURES_LIMIT = 6
+
+
+_DECODER = json.JSONDecoder()
+
+
+def loads(body: bytes) -> Any:
+    """Decode a JSON body, with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class Visit:
+    """Fields of a MonitoredStopVisit needed to build a departure"""
+
+    __slots__ = ("line_id", "line_name", "direction", "aimed", "expected", "cancelled")
+
+    def __init__(self, line_id: str, line_name: str, direction: str,
+                 aimed: str, expected: str, cancelled: bool):
+        self.line_id = line_id
+        self.line_name = line_name
+        self.direction = direction
+        self.aimed = aimed
+        self.expected = expected
+        self.cancelled = cancelled
+
+
+# ==================== DECODING ====================
+
+def extract_line_name(line_ref: str, journey: dict) -> str:
+    pub_names = journey.get("PublishedLineName")
+    if pub_names:
+        return pub_names[0].get("value", "")
+    if line_ref:
+        parts = line_ref.split(":")
+        if len(parts) >= 4:
+            code = parts[3]
+            if code.startswith("C0"):
+                code = code[2:].lstrip("0") or "0"
+            return code
+    return "?"
+
+
+def visit_from_dict(visit: dict) -> Optional[Visit]:
+    """Visit from one MonitoredStopVisit, or None when it has no time"""
+    journey = visit.get("MonitoredVehicleJourney") or {}
+    call = journey.get("MonitoredCall") or {}
+
+    aimed = call.get("AimedDepartureTime") or call.get("AimedArrivalTime") or ""
+    expected = call.get("ExpectedDepartureTime") or call.get("ExpectedArrivalTime") or ""
+    if not aimed and not expected:
+        return None
+
+    line_ref = (journey.get("LineRef") or {}).get("value", "")
+    dest_names = journey.get("DestinationName")
+    return Visit(
+        line_id=line_ref,
+        line_name=extract_line_name(line_ref, journey),
+        direction=dest_names[0].get("value", "") if dest_names else "",
+        aimed=aimed,
+        expected=expected,
+        cancelled="cancelled" in (call.get("DepartureStatus") or "").lower(),
+    )
+
+
+def monitored_visits(data: dict) -> List[dict]:
+    """MonitoredStopVisit list of a decoded response"""
+    delivery = ((data.get("Siri") or {}).get("ServiceDelivery") or {}).get("StopMonitoringDelivery")
+    if not delivery:
+        siri_logger.debug("No StopMonitoringDelivery in response")
+        return []
+    return delivery[0].get("MonitoredStopVisit") or []
+
+
+def decode_visits(body: bytes) -> List[Visit]:
+    """Visits of a StopMonitoring response body"""
+    visits = monitored_visits(loads(body))
+    if siri_logger.isEnabledFor(logging.DEBUG):
+        siri_logger.debug("Found %d monitored visits", len(visits))
+    decoded = (visit_from_dict(v) for v in visits)
+    return [v for v in decoded if v is not None]
+
+
+class VisitScanner:
+    """
+    Incremental decoder of the MonitoredStopVisit array of a response body.
+    feed() takes the body chunk by chunk and returns the visits completed by
+    each chunk; only the text of the visit being downloaded is buffered.
+    Each visit is decoded by the C scanner of the json module, which also
+    tells where it ends: an incomplete visit is retried with the next chunk.
+    """
+
+    _ARRAY = re.compile(r'"MonitoredStopVisit"\s*:\s*')
+    # Separators between visits
+    _SEPARATOR = re.compile(r'[\s,]*')
+    # Longest partial match of _ARRAY kept between chunks
+    _ARRAY_TAIL = 64
+
+    def __init__(self):
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._seeking = True
+        self._done = False
+        self.count = 0
+
+    @property
+    def done(self) -> bool:
+        """True once the end of the visit array has been read"""
+        return self._done
+
+    def feed(self, chunk: bytes) -> List[Visit]:
+        if self._done:
+            return []
+        self._buffer += self._text.decode(chunk)
+        if self._seeking and not self._seek():
+            return []
+
+        buffer = self._buffer
+        decode = _DECODER.raw_decode
+        visits = []
+        pos = 0
+        while True:
+            pos = self._SEPARATOR.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                self._done = True
+                break
+            try:
+                visit, end = decode(buffer, pos)
+            except ValueError:
+                # Visit cut by the end of the chunk
+                break
+            pos = end
+            self.count += 1
+            visit = visit_from_dict(visit)
+            if visit is not None:
+                visits.append(visit)
+
+        self._buffer = "" if self._done else buffer[pos:]
+        return visits
+
+    def close(self):
+        """Check that the body held the whole visit array"""
+        if not self._seeking and not self._done:
+            raise ValueError("Incomplete StopMonitoring response")
+
+    def _seek(self) -> bool:
+        """Skip the body up to the visit array, True once inside it"""
+        buffer = self._buffer
+        match = self._ARRAY.search(buffer)
+        if match is None or match.end() == len(buffer):
+            # Keep enough to match the key once the next chunk arrives
+            self._buffer = buffer[match.start() if match else max(0, len(buffer) - self._ARRAY_TAIL):]
+            return False
+        self._seeking = False
+        if buffer[match.end()] != "[":  # not an array (e.g. null): no visits
+            self._done = True
+            self._buffer = ""
+            return False
+        self._buffer = buffer[match.end() + 1:]
+        return True
+
+
+# ==================== SELECTION ====================
+
+@lru_cache(maxsize=4096)
+def parse_time(time_str: str) -> Optional[datetime]:
+    """IDFM timestamp (UTC, e.g. 2024-01-15T14:32:00.000Z) in Paris time, or None"""
+    try:
+        if '.' in time_str:
+            time_str = time_str.split('.')[0] + 'Z'
+        dt = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
+        return dt.astimezone(PARIS_TZ)
+    except (ValueError, TypeError):
+        return None
+
+
+@lru_cache(maxsize=1024)
+def line_code(line_id: str) -> str:
+    """Code of a line id, e.g. C01742 for STIF:Line::C01742: and IDFM:C01742"""
+    parts = [p for p in line_id.split(":") if p]
+    return parts[-1] if parts else ""
+
+
+def line_matches(config_line_id: str, line_ref: str) -> bool:
+    """Compare line ids by their code"""
+    return line_code(config_line_id) == line_code(line_ref)
+
+
+def direction_matches(config_dir: str, api_dir: str) -> bool:
+    c = config_dir.lower().strip()
+    a = api_dir.lower().strip()
+    return c in a or a in c
+
+
+def to_departure(visit: Visit, now: datetime) -> Departure:
+    """Convert a visit to the API model"""
+    scheduled = parse_time(visit.aimed or visit.expected) or now
+    expected = parse_time(visit.expected or visit.aimed) or now
+    delay_minutes = int((expected - scheduled).total_seconds() / 60)
+
+    if visit.cancelled:
+        status = "Supprimé"
+    elif delay_minutes > 2:
+        status = "Retardé"
+    elif delay_minutes < -1:
+        status = "En avance"
+    else:
+        status = "À l'heure"
+
+    return Departure(
+        line=visit.line_name, line_id=visit.line_id, direction=visit.direction,
+        scheduled=scheduled, expected=expected,
+        delay_minutes=delay_minutes, status=status,
+        is_realtime=bool(visit.expected)
+    )
+
+
+class DepartureSelection:
+    """
+    Next departures of several stops sharing a MonitoringRef, built in one
+    pass over the visits: each stop keeps its `limit` soonest matching
+    visits in a bounded heap, so visits can be added as they are decoded.
+    """
+
+    def __init__(self, stop_configs: Sequence[StopConfig], now: datetime, limit: int = DEPARTURES_LIMIT):
+        self.now = now
+        self.limit = limit
+        self._now_ts = now.timestamp()
+        self._seq = 0
+        # Per stop: line code (or None), direction (or None) and heap of (-time, -seq, visit)
+        self._filters = []
+        self._heaps: List[list] = []
+        for s in stop_configs:
+            direction = s.direction
+            if direction and "toutes directions" in direction.lower():
+                direction = None
+            self._filters.append((line_code(s.line_id) if s.line_id else None, direction))
+            self._heaps.append([])
+        self._debug = siri_logger.isEnabledFor(logging.DEBUG)
+
+    def add(self, visit: Visit):
+        self._seq += 1
+        when = parse_time(visit.expected or visit.aimed)
+        entry = (-(when.timestamp() if when else self._now_ts), -self._seq, visit)
+        code = line_code(visit.line_id)
+        for (line, direction), heap in zip(self._filters, self._heaps):
+            # Filter by line (grouped requests are not filtered by PRIM)
+            if line is not None and line != code:
+                continue
+            # Filter by direction if specified
+            if direction and not direction_matches(direction, visit.direction):
+                if self._debug:
+                    siri_logger.debug("Filtered out: %s doesn't match %s", visit.direction, direction)
+                continue
+            if len(heap) < self.limit:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    def extend(self, visits: Iterable[Visit]):
+        for visit in visits:
+            self.add(visit)
+
+    def departures(self) -> List[List[Departure]]:
+        """Departures of each stop, soonest first; only these are turned into models"""
+        return [[to_departure(visit, self.now) for _, _, visit in sorted(heap, reverse=True)]
+                for heap in self._heaps]
+
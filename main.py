@@ -1,18 +1,27 @@
 from fastapi import FastAPI, Request, HTTPException, Form
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import asyncio
-import json
 import os
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 import pytz
 
-from api.client import IDFMClient, PARIS_TZ
+from api.client import IDFMClient, RateBudget, PARIS_TZ, load_rate_budgets, rate_budget_id, save_rate_budgets
 from api.config import ConfigManager
 from api.models import StopConfig, StopDepartures
+from api.refresh import RefreshEngine, stop_key
+from api.log import API_LOGGER, get_levels, get_logger, set_level, setup_logging, shutdown_logging
+from api.search_index import shared_search_index
+from api.metrics import REGISTRY, SEARCH_SECONDS
+from api.broadcast import Broadcaster, PayloadCache, etag_matches, sse_message
+from api.cache import CACHES, configure_caches, load_caches, save_caches
+
+setup_logging()
+logger = get_logger("app")
+api_logger = get_logger(API_LOGGER)
 
 # Initialize app
 app = FastAPI(title="Paris Transit Dashboard")
@@ -33,16 +42,90 @@ config_manager = ConfigManager(config_path)
 idfm_client: Optional[IDFMClient] = None
 current_data: Dict[str, StopDepartures] = {}
 background_task = None
+# One request budget per API key, kept when the client is replaced
+rate_budgets: Dict[str, RateBudget] = {}
 
 
 def get_client() -> Optional[IDFMClient]:
     """Get or create IDFM client"""
     global idfm_client
     if config_manager.api_key and not idfm_client:
-        idfm_client = IDFMClient(config_manager.api_key)
+        idfm_client = new_client(config_manager.api_key)
+    return idfm_client
+
+
+def get_rate_budget(api_key: str) -> RateBudget:
+    """Budget shared by every client of an API key, seeded with today's saved usage"""
+    key_id = rate_budget_id(api_key)
+    budget = rate_budgets.get(key_id)
+    if budget is None:
+        budget = RateBudget(config_manager.daily_quota, config_manager.requests_per_second)
+        saved = load_rate_budgets(config_manager.rate_budget_file).get(key_id)
+        if saved:
+            budget.restore(saved)
+        rate_budgets[key_id] = budget
+    else:
+        budget.daily_limit = config_manager.daily_quota
+        budget.per_second = config_manager.requests_per_second
+    return budget
+
+
+def new_client(api_key: str) -> IDFMClient:
+    """Create an IDFM client using the configured connection pool settings"""
+    return IDFMClient(
+        api_key,
+        http_limits=config_manager.http_limits,
+        http2=config_manager.http2,
+        rate_budget=get_rate_budget(api_key),
+        stream_departures=config_manager.stream_departures
+    )
+
+
+async def replace_client(api_key: str) -> IDFMClient:
+    """Swap the global client for one using a new API key, closing the old pools"""
+    global idfm_client
+    old_client = idfm_client
+    idfm_client = new_client(api_key)
+    if old_client:
+        await old_client.aclose()
+    save_rate_budgets(config_manager.rate_budget_file, rate_budgets)
     return idfm_client
 
 
+broadcaster = Broadcaster()
+departures_cache = PayloadCache(lambda: build_departures_payload())
+refresh_engine = RefreshEngine(config_manager, get_client, current_data,
+                               on_update=lambda keys: publish_changes(keys))
+
+
+def _stop_data_age() -> Dict[tuple, float]:
+    now = paris_now()
+    return {(key,): round((now - data.last_updated).total_seconds(), 1) for key, data in current_data.items()}
+
+
+REGISTRY.gauge("transit_stop_data_age_seconds", "Age of the departure data held for each stop",
+               ["stop"], collect=_stop_data_age)
+REGISTRY.gauge("transit_sse_subscribers", "Connected SSE clients",
+               collect=lambda: {(): broadcaster.subscriber_count})
+REGISTRY.gauge("transit_sse_queue_depth", "Messages waiting in SSE client queues",
+               ["stat"], collect=lambda: {
+                   ("max",): max(broadcaster.queue_depths(), default=0),
+                   ("total",): sum(broadcaster.queue_depths()),
+               })
+REGISTRY.counter("transit_sse_resyncs_total", "Snapshots sent to SSE clients that fell behind",
+                 collect=lambda: {(): broadcaster.resyncs})
+REGISTRY.counter("transit_cache_hits_total", "Cache hits", ["cache"],
+                 collect=lambda: {("departures",): departures_cache.hits,
+                                  **{(name,): c.hits for name, c in CACHES.items()}})
+REGISTRY.counter("transit_cache_misses_total", "Cache misses", ["cache"],
+                 collect=lambda: {("departures",): departures_cache.misses,
+                                  **{(name,): c.misses for name, c in CACHES.items()}})
+REGISTRY.counter("transit_cache_coalesced_total", "Lookups that waited for an identical in-flight request",
+                 ["cache"], collect=lambda: {(name,): c.coalesced for name, c in CACHES.items()})
+REGISTRY.gauge("transit_cache_entries", "Entries held by each lookup cache", ["cache"],
+               collect=lambda: {(name,): len(c) for name, c in CACHES.items()})
+
+
 def paris_now() -> datetime:
     """Get current Paris time"""
     return datetime.now(PARIS_TZ)
@@ -50,43 +133,62 @@ def paris_now() -> datetime:
 
 async def fetch_all_stops():
     """Background task to continuously refresh transit data"""
-    global current_data
-    
-    print(f"[FETCH] Background task started")
-    
-    while True:
-        client = get_client()
-        if client and config_manager.stops:
-            print(f"[{paris_now().strftime('%H:%M:%S')}] Fetching transit data for {len(config_manager.stops)} stops...")
-            
-            for stop_config in config_manager.stops:
-                try:
-                    key = f"{stop_config.id}:{stop_config.direction or ''}"
-                    print(f"  Fetching {stop_config.name} (key: {key})...")
-                    departures = await client.get_departures(stop_config)
-                    current_data[key] = departures
-                    print(f"  ✓ Got {len(departures.departures)} departures for {stop_config.name}")
-                except Exception as e:
-                    print(f"  ✗ Error fetching {stop_config.name}: {e}")
-            
-            print(f"  ✓ Updated {len(config_manager.stops)} stops. Current data keys: {list(current_data.keys())}")
-        else:
-            print(f"[FETCH] Waiting... client={client is not None}, stops={len(config_manager.stops) if config_manager.stops else 0}")
-        
-        await asyncio.sleep(config_manager.refresh_interval)
+    await refresh_engine.run()
+
+
+def ensure_background_task():
+    """Start the refresh task unless it is already running"""
+    global background_task
+    if background_task is None or background_task.done():
+        background_task = asyncio.create_task(fetch_all_stops())
 
 
 @app.on_event("startup")
 async def startup():
     """Start background refresh task on app startup"""
     global background_task
-    print("🚀 Transit Dashboard starting...")
+    logger.info("🚀 Transit Dashboard starting...")
+    
+    # Load the shared search index off the event loop
+    await asyncio.to_thread(shared_search_index.warm)
+    
+    configure_caches(config_manager.cache_ttls)
+    if config_manager.cache_file:
+        load_caches(config_manager.cache_file)
+    
+    client = get_client()
+    if client:
+        await client.open()
     
     if config_manager.is_configured():
-        print(f"📍 Monitoring {len(config_manager.stops)} stops")
+        logger.info("📍 Monitoring %d stops", len(config_manager.stops))
         background_task = asyncio.create_task(fetch_all_stops())
     else:
-        print("⚠️  Dashboard not configured - visit /setup or /admin")
+        logger.warning("⚠️  Dashboard not configured - visit /setup or /admin")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the refresh task and close API connection pools"""
+    if background_task and not background_task.done():
+        background_task.cancel()
+        try:
+            await background_task
+        except asyncio.CancelledError:
+            pass
+    
+    if idfm_client:
+        await idfm_client.aclose()
+    if rate_budgets:
+        save_rate_budgets(config_manager.rate_budget_file, rate_budgets)
+    
+    if config_manager.cache_file:
+        save_caches(config_manager.cache_file)
+    
+    # Write any config change still waiting for its debounced save
+    await asyncio.to_thread(config_manager.flush)
+    
+    shutdown_logging()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -123,82 +225,152 @@ async def admin_page(request: Request):
     })
 
 
-@app.get("/api/departures")
-async def get_departures():
-    """Get current departure data for all configured stops"""
-    stops_data = []
+def build_stop_entry(index: int, stop_config: StopConfig, data: Optional[StopDepartures]) -> dict:
+    """Build the display data for one configured stop"""
+    entry = {
+        "key": stop_key(stop_config),
+        "index": index,
+        "id": stop_config.id,
+        "name": stop_config.name,
+        "line": stop_config.line,
+        "direction": stop_config.direction,
+        "transport_type": stop_config.transport_type,
+    }
     
-    print(f"[GET_DEPARTURES] Called. Config has {len(config_manager.stops)} stops")
-    print(f"[GET_DEPARTURES] current_data has {len(current_data)} keys: {list(current_data.keys())}")
+    if data is None:
+        entry.update({
+            "version": 0,
+            "departures": [],
+            "error": "En attente de données..."
+        })
+        return entry
+    
+    entry.update({
+        "version": data.version,
+        "last_updated": data.last_updated.isoformat(),
+        "departures": [
+            {
+                "line": dep.line,
+                "direction": dep.direction,
+                "scheduled": dep.scheduled.isoformat(),
+                "expected": dep.expected.isoformat(),
+                "delay_minutes": dep.delay_minutes,
+                "status": dep.status,
+                "is_realtime": dep.is_realtime
+            }
+            for dep in data.departures[:config_manager.max_departures]
+        ],
+        "is_cached": data.is_cached,
+        "error": data.error
+    })
+    return entry
+
+
+def build_departures_payload(keys: Optional[List[str]] = None, changed_since: Optional[int] = None) -> dict:
+    """
+    Build the departure data for configured stops.
+    All stops by default; only the given keys, or only stops whose version is
+    newer than changed_since, for patches. "order" always lists every stop key.
+    """
+    stops_data = []
+    order = []
     
     for i, stop_config in enumerate(config_manager.stops):
-        key = f"{stop_config.id}:{stop_config.direction or ''}"
-        print(f"[GET_DEPARTURES] Stop {i}: Looking for key '{key}'")
-        print(f"[GET_DEPARTURES]   Stop config: id={stop_config.id}, name={stop_config.name}, direction={stop_config.direction}")
+        key = stop_key(stop_config)
+        order.append(key)
+        data = current_data.get(key)
         
-        if key in current_data:
-            print(f"[GET_DEPARTURES]   ✓ Found data for key '{key}'")
-            data = current_data[key]
-            stops_data.append({
-                "index": i,
-                "id": stop_config.id,
-                "name": stop_config.name,
-                "line": stop_config.line,
-                "direction": stop_config.direction,
-                "transport_type": stop_config.transport_type,
-                "last_updated": data.last_updated.isoformat(),
-                "departures": [
-                    {
-                        "line": dep.line,
-                        "direction": dep.direction,
-                        "scheduled": dep.scheduled.isoformat(),
-                        "expected": dep.expected.isoformat(),
-                        "delay_minutes": dep.delay_minutes,
-                        "status": dep.status,
-                        "is_realtime": dep.is_realtime
-                    }
-                    for dep in data.departures[:config_manager.max_departures]
-                ],
-                "is_cached": data.is_cached,
-                "error": data.error
-            })
-        else:
-            print(f"[GET_DEPARTURES]   ✗ Key '{key}' NOT FOUND in current_data")
-            stops_data.append({
-                "index": i,
-                "id": stop_config.id,
-                "name": stop_config.name,
-                "line": stop_config.line,
-                "direction": stop_config.direction,
-                "transport_type": stop_config.transport_type,
-                "departures": [],
-                "error": "En attente de données..."
-            })
+        if keys is not None and key not in keys:
+            continue
+        if changed_since is not None and data is not None and data.version <= changed_since:
+            continue
+        stops_data.append(build_stop_entry(i, stop_config, data))
     
     return {
         "timestamp": paris_now().isoformat(),
         "paris_time": paris_now().strftime("%H:%M:%S"),
+        "version": refresh_engine.version,
+        "order": order,
         "stops": stops_data,
-        "num_columns": min(4, max(1, len(stops_data)))
+        "num_columns": min(4, max(1, len(order)))
+    }
+
+
+def current_event_id() -> str:
+    return f"{refresh_engine.epoch}-{refresh_engine.version}"
+
+
+def resume_version(last_event_id: str) -> Optional[int]:
+    """Version a reconnecting client already has, if it can be resumed with a patch"""
+    epoch, _, version = last_event_id.partition("-")
+    if epoch != str(refresh_engine.epoch) or not version.isdigit():
+        return None
+    version = int(version)
+    return version if version <= refresh_engine.version else None
+
+
+def cached_departures() -> Tuple[bytes, str]:
+    """Encoded full payload and ETag, rebuilt only when stop data or config change"""
+    return departures_cache.get((refresh_engine.epoch, refresh_engine.version, config_manager.version))
+
+
+def snapshot_message() -> bytes:
+    body, _ = cached_departures()
+    header = f"retry: 5000\nid: {current_event_id()}\nevent: snapshot\ndata: ".encode("utf-8")
+    return header + body + b"\n\n"
+
+
+def publish_departures():
+    """Send a full snapshot to every SSE subscriber, e.g. after a config change"""
+    try:
+        broadcaster.publish(snapshot_message())
+    except Exception as e:
+        logger.warning("SSE error: %s", e)
+
+
+def publish_changes(changed_keys: List[str]):
+    """Send only the stops whose data changed to every SSE subscriber"""
+    try:
+        broadcaster.publish(sse_message(build_departures_payload(keys=changed_keys), event="patch",
+                                        event_id=current_event_id()))
+    except Exception as e:
+        logger.warning("SSE error: %s", e)
+
+
+@app.get("/api/departures")
+async def get_departures(request: Request):
+    """Get current departure data for all configured stops"""
+    body, etag = cached_departures()
+    api_logger.debug("GET /api/departures etag=%s if-none-match=%s", etag, request.headers.get("if-none-match"))
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Paris-Time": paris_now().strftime("%H:%M:%S"),
     }
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get("/events")
-async def events():
-    """Server-Sent Events endpoint for real-time updates"""
-    async def event_stream():
-        while True:
-            try:
-                data = await get_departures()
-                event_data = json.dumps(data, default=str)
-                yield f"data: {event_data}\n\n"
-            except Exception as e:
-                print(f"SSE error: {e}")
-            
-            await asyncio.sleep(5)
+async def events(request: Request):
+    """
+    Server-Sent Events endpoint for real-time updates.
+    Sends a full "snapshot" on connect, then "patch" events with only the stops
+    that changed. Reconnecting clients resume from Last-Event-ID with a patch.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    
+    def initial() -> bytes:
+        since = resume_version(last_event_id)
+        if since is None:
+            return snapshot_message()
+        return sse_message(build_departures_payload(changed_since=since), event="patch",
+                           event_id=current_event_id(), retry_ms=5000)
     
     return StreamingResponse(
-        event_stream(),
+        broadcaster.stream(initial, snapshot_message),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -212,18 +384,15 @@ async def events():
 @app.post("/api/config/apikey")
 async def set_api_key(api_key: str = Form(...)):
     """Set or update API key"""
-    global idfm_client, background_task
-    
     config_manager.api_key = api_key
-    idfm_client = IDFMClient(api_key)
+    client = await replace_client(api_key)
     
     # Test the connection
-    result = await idfm_client.test_connection()
+    result = await client.test_connection()
     
     if result["success"]:
         # Start background task if not running
-        if background_task is None or background_task.done():
-            background_task = asyncio.create_task(fetch_all_stops())
+        ensure_background_task()
     
     return result
 
@@ -231,38 +400,34 @@ async def set_api_key(api_key: str = Form(...)):
 @app.post("/api/config/validate")
 async def validate_api_key(request: Request):
     """Validate and save API key"""
-    global idfm_client, background_task
-    
     try:
         data = await request.json()
         api_key = data.get('api_key', '').strip()
         
-        print(f"[VALIDATE] Received API key: {api_key[:10]}... (length: {len(api_key)})")
+        logger.info("[VALIDATE] Received API key: %s... (length: %d)", api_key[:10], len(api_key))
         
         if not api_key:
-            print("[VALIDATE] Empty key")
+            logger.info("[VALIDATE] Empty key")
             return {"success": False, "message": "Clé API vide"}
         
         if len(api_key) < 20:
-            print(f"[VALIDATE] Key too short: {len(api_key)} chars")
+            logger.info("[VALIDATE] Key too short: %d chars", len(api_key))
             return {"success": False, "message": "Clé API trop courte (doit faire au moins 20 caractères)"}
         
         # Create client and test connection
-        idfm_client = IDFMClient(api_key)
-        result = await idfm_client.test_connection()
+        client = await replace_client(api_key)
+        result = await client.test_connection()
         
-        print(f"[VALIDATE] Test result: {result}")
+        logger.info("[VALIDATE] Test result: %s", result)
         
         # If rate limited, save anyway and warn user
         if not result["success"] and "rate limit" in result.get("message", "").lower():
-            print("[VALIDATE] Rate limited - saving key anyway")
+            logger.warning("[VALIDATE] Rate limited - saving key anyway")
             config_manager.api_key = api_key
-            config_manager.save()
             
             # Start background task if stops are configured
             if config_manager.stops:
-                if background_task is None or background_task.done():
-                    background_task = asyncio.create_task(fetch_all_stops())
+                ensure_background_task()
             
             return {
                 "success": True, 
@@ -271,23 +436,21 @@ async def validate_api_key(request: Request):
         
         # If validation failed for other reasons, don't save
         if not result["success"]:
-            print(f"[VALIDATE] Validation failed: {result['message']}")
+            logger.info("[VALIDATE] Validation failed: %s", result["message"])
             return result
         
         # Success - save the key
         config_manager.api_key = api_key
-        config_manager.save()
-        print(f"[VALIDATE] Key saved successfully")
+        logger.info("[VALIDATE] Key saved successfully")
         
         # Start background task if stops are configured
         if config_manager.stops:
-            if background_task is None or background_task.done():
-                background_task = asyncio.create_task(fetch_all_stops())
+            ensure_background_task()
         
         return {"success": True, "message": "✓ Clé API validée et enregistrée"}
         
     except Exception as e:
-        print(f"[VALIDATE] Exception: {e}")
+        logger.exception("[VALIDATE] Exception: %s", e)
         return {"success": False, "message": f"Erreur: {str(e)}"}
 
 
@@ -307,7 +470,8 @@ async def search_stops(q: str, transport_type: str = None):
     if not client:
         return {"error": "API non configurée", "results": []}
     
-    results = await client.search_stops(q, transport_type)
+    with SEARCH_SECONDS.time(kind="stops"):
+        results = await client.search_stops(q, transport_type)
     return {"results": [r.model_dump() for r in results]}
 
 
@@ -318,7 +482,8 @@ async def search_lines(q: str):
     if not client:
         return {"error": "API non configurée", "results": []}
     
-    results = await client.search_lines(q)
+    with SEARCH_SECONDS.time(kind="lines"):
+        results = await client.search_lines(q)
     return {"results": results}
 
 
@@ -329,7 +494,8 @@ async def search_address(q: str):
     if not client:
         return {"error": "API non configurée", "results": []}
     
-    results = await client.search_address(q)
+    with SEARCH_SECONDS.time(kind="address"):
+        results = await client.search_address(q)
     return {"results": results}
 
 
@@ -340,7 +506,8 @@ async def find_nearby_stops(lat: float, lon: float, radius: int = 500):
     if not client:
         return {"error": "API non configurée", "results": []}
     
-    results = await client.find_stops_near(lat, lon, radius)
+    with SEARCH_SECONDS.time(kind="nearby"):
+        results = await client.find_stops_near(lat, lon, radius)
     return {"results": results}
 
 
@@ -355,6 +522,35 @@ async def get_lines_at_stop(stop_id: str):
     return {"results": results}
 
 
+# Maximum number of stops per /api/stops/lines:batch request
+MAX_BATCH_STOPS = 50
+
+
+@app.post("/api/stops/lines:batch")
+async def get_lines_at_stops(request: Request):
+    """
+    Get the lines serving several stops at once (JSON body: {"stop_ids": [raw IDFM stop_ids]}).
+    Stops whose lines could not be fetched are missing from "results"; invalid ids are listed in "errors".
+    """
+    client = get_client()
+    if not client:
+        return {"error": "API non configurée", "results": {}, "errors": {}}
+    
+    try:
+        data = await request.json()
+        stop_ids = data.get("stop_ids", [])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Corps JSON invalide")
+    
+    if not isinstance(stop_ids, list) or not all(isinstance(s, str) for s in stop_ids):
+        raise HTTPException(status_code=400, detail="stop_ids doit être une liste d'identifiants")
+    if len(stop_ids) > MAX_BATCH_STOPS:
+        raise HTTPException(status_code=400, detail=f"{MAX_BATCH_STOPS} arrêts maximum par requête")
+    
+    results, errors = await client.get_lines_at_stops(stop_ids)
+    return {"results": results, "errors": errors}
+
+
 @app.get("/api/stop/directions")
 async def get_directions(stop_id: str, line_id: str = None):
     """Get available directions at a stop"""
@@ -377,8 +573,6 @@ async def add_stop(
     transport_type: str = Form("bus")
 ):
     """Add a new stop to monitoring"""
-    global background_task
-    
     stop = StopConfig(
         id=stop_id,
         name=stop_name,
@@ -392,15 +586,10 @@ async def add_stop(
     success = config_manager.add_stop(stop)
     
     if success:
-        # Restart background task to fetch new stop
-        print(f"[ADD_STOP] Stop added, restarting background task")
-        if background_task and not background_task.done():
-            background_task.cancel()
-            try:
-                await background_task
-            except asyncio.CancelledError:
-                pass
-        background_task = asyncio.create_task(fetch_all_stops())
+        # The refresh engine fetches the new stop as soon as it is saved
+        logger.info("[ADD_STOP] Stop added")
+        ensure_background_task()
+        publish_departures()
         
         return {"success": True, "message": f"Arrêt {stop_name} ajouté"}
     else:
@@ -410,25 +599,12 @@ async def add_stop(
 @app.post("/api/stops/remove")
 async def remove_stop(stop_id: str = Form(...), direction: str = Form(None)):
     """Remove a stop from monitoring"""
-    global background_task
-    
     success = config_manager.remove_stop(stop_id, direction)
     
     if success:
-        # Clean up cached data
-        key = f"{stop_id}:{direction or ''}"
-        if key in current_data:
-            del current_data[key]
-        
-        # Restart background task
-        print(f"[REMOVE_STOP] Stop removed, restarting background task")
-        if background_task and not background_task.done():
-            background_task.cancel()
-            try:
-                await background_task
-            except asyncio.CancelledError:
-                pass
-        background_task = asyncio.create_task(fetch_all_stops())
+        # The refresh engine drops the stop's data, other stops keep their schedule
+        logger.info("[REMOVE_STOP] Stop removed")
+        publish_departures()
         
         return {"success": True}
     return {"success": False, "message": "Arrêt non trouvé"}
@@ -438,6 +614,8 @@ async def remove_stop(stop_id: str = Form(...), direction: str = Form(None)):
 async def reorder_stops(order: List[int]):
     """Reorder stops"""
     success = config_manager.reorder_stops(order)
+    if success:
+        publish_departures()
     return {"success": success}
 
 
@@ -462,13 +640,41 @@ async def set_refresh_interval(interval: int = Form(...)):
     return {"success": False, "message": "Intervalle doit être entre 10 et 300 secondes"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/admin/log_level")
+async def get_log_levels():
+    """Get the level of each dashboard logger"""
+    return {"levels": get_levels()}
+
+
+@app.post("/api/admin/log_level")
+async def set_log_level(level: str = Form(...), logger_name: str = Form("transit")):
+    """
+    Change a logger's level at runtime, e.g. level=DEBUG logger_name=transit.siri
+    to trace every parsed visit, or transit.api for every request
+    """
+    if set_level(level, logger_name):
+        return {"success": True, "levels": get_levels()}
+    return {"success": False, "message": "Niveau invalide (DEBUG, INFO, WARNING, ERROR, CRITICAL)"}
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
+    client = get_client()
     return {
         "status": "ok",
         "configured": config_manager.is_configured(),
         "stops_count": len(config_manager.stops),
+        "refresh": refresh_engine.stats(),
+        "rate_budget": client.rate_budget.snapshot() if client else None,
+        "search_index": shared_search_index.info(),
+        "caches": {name: cache.stats() for name, cache in CACHES.items()},
         "paris_time": paris_now().strftime("%H:%M:%S")
     }
 
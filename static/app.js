@@ -10,15 +10,19 @@ const cachedIndicator = document.getElementById('cached-indicator');
 let eventSource = null;
 let isOnline = true;
 let parisTimeOffset = null;
+let stopsByKey = {};
+let stopOrder = [];
 
 // Initialize Paris time offset
 async function initParisTime() {
     try {
         const response = await fetch('/api/departures');
         const data = await response.json();
-        if (data.paris_time) {
+        // The body may be cached, the header carries the time of this response
+        const parisTime = response.headers.get('X-Paris-Time') || data.paris_time;
+        if (parisTime) {
             // Calculate offset between server Paris time and local time
-            const serverParts = data.paris_time.split(':').map(Number);
+            const serverParts = parisTime.split(':').map(Number);
             const serverSeconds = serverParts[0] * 3600 + serverParts[1] * 60 + serverParts[2];
             const now = new Date();
             const localSeconds = now.getHours() * 3600 + now.getMinutes() * 60 + now.getSeconds();
@@ -79,8 +83,12 @@ function getTransportIcon(type) {
     return icons[type] || '🚏';
 }
 
-// Render all departures
+// Render all departures (full snapshot)
 function renderDepartures(data) {
+    stopsByKey = {};
+    (data.stops || []).forEach(stop => { stopsByKey[stop.key] = stop; });
+    stopOrder = data.order || (data.stops || []).map(stop => stop.key);
+    
     if (!data.stops || data.stops.length === 0) {
         container.innerHTML = '<div class="loading">Aucune donnée disponible</div>';
         return;
@@ -90,19 +98,75 @@ function renderDepartures(data) {
     const numCols = data.num_columns || Math.min(4, data.stops.length);
     container.className = `departures-container cols-${numCols}`;
     
-    let anyCached = false;
-    let anyError = false;
+    container.innerHTML = stopOrder
+        .filter(key => stopsByKey[key])
+        .map(key => renderStop(stopsByKey[key]))
+        .join('');
     
-    const html = data.stops.map(stop => {
-        if (stop.is_cached) anyCached = true;
-        if (stop.error) anyError = true;
-        
-        return renderStop(stop);
-    }).join('');
+    updateCachedIndicator();
+}
+
+// Apply a patch: only the stops that changed are re-rendered
+function applyPatch(data) {
+    if (!container.querySelector('.stop')) {
+        container.innerHTML = '';
+    }
+    
+    (data.stops || []).forEach(stop => {
+        const existing = stopsByKey[stop.key];
+        if (existing && existing.version > stop.version) return;
+        stopsByKey[stop.key] = stop;
+        updateStopCard(stop);
+    });
     
-    container.innerHTML = html;
+    if (data.order) {
+        syncOrder(data.order);
+    }
+    
+    if (data.num_columns) {
+        container.className = `departures-container cols-${data.num_columns}`;
+    }
+    
+    updateCachedIndicator();
+}
+
+// Replace (or add) the card of a single stop
+function updateStopCard(stop) {
+    const card = container.querySelector(`.stop[data-key="${CSS.escape(stop.key)}"]`);
+    const template = document.createElement('template');
+    template.innerHTML = renderStop(stop).trim();
+    const newCard = template.content.firstElementChild;
+    
+    if (card) {
+        card.replaceWith(newCard);
+    } else {
+        container.appendChild(newCard);
+    }
+}
+
+// Remove cards of deleted stops and move cards to match the server order
+function syncOrder(order) {
+    const wanted = new Set(order);
+    Object.keys(stopsByKey).forEach(key => {
+        if (!wanted.has(key)) delete stopsByKey[key];
+    });
+    container.querySelectorAll('.stop[data-key]').forEach(card => {
+        if (!wanted.has(card.dataset.key)) card.remove();
+    });
     
-    // Show/hide cached indicator
+    const current = Array.from(container.querySelectorAll('.stop[data-key]')).map(card => card.dataset.key);
+    if (current.join('|') !== order.filter(key => stopsByKey[key]).join('|')) {
+        order.forEach(key => {
+            const card = container.querySelector(`.stop[data-key="${CSS.escape(key)}"]`);
+            if (card) container.appendChild(card);
+        });
+    }
+    stopOrder = order;
+}
+
+// Show/hide cached indicator
+function updateCachedIndicator() {
+    const anyCached = Object.values(stopsByKey).some(stop => stop.is_cached);
     cachedIndicator.style.display = anyCached ? 'block' : 'none';
 }
 
@@ -112,7 +176,7 @@ function renderStop(stop) {
     const departuresHtml = renderDeparturesList(stop.departures, stop.error);
     
     return `
-        <div class="stop">
+        <div class="stop" data-key="${stop.key}">
             <div class="stop-header">
                 <div class="line-badge ${transportClass}">${stop.line}</div>
                 <span class="stop-name">${stop.name}</span>
@@ -203,25 +267,36 @@ function connectSSE() {
     
     eventSource = new EventSource('/events');
     
-    eventSource.onmessage = (event) => {
+    eventSource.addEventListener('snapshot', (event) => {
         try {
-            const data = JSON.parse(event.data);
-            renderDepartures(data);
+            renderDepartures(JSON.parse(event.data));
             setOnlineStatus(true);
         } catch (err) {
-            console.error('Error parsing SSE data:', err);
+            console.error('Error parsing SSE snapshot:', err);
         }
-    };
+    });
+    
+    eventSource.addEventListener('patch', (event) => {
+        try {
+            applyPatch(JSON.parse(event.data));
+            setOnlineStatus(true);
+        } catch (err) {
+            console.error('Error parsing SSE patch:', err);
+        }
+    });
     
     eventSource.onerror = (error) => {
         console.error('SSE error:', error);
         setOnlineStatus(false);
         
-        // Try to reconnect after 5 seconds
-        setTimeout(() => {
-            console.log('Attempting to reconnect...');
-            connectSSE();
-        }, 5000);
+        // The browser reconnects by itself (resuming with Last-Event-ID),
+        // only start over if it gave up
+        if (eventSource.readyState === EventSource.CLOSED) {
+            setTimeout(() => {
+                console.log('Attempting to reconnect...');
+                connectSSE();
+            }, 5000);
+        }
     };
     
     eventSource.onopen = () => {
@@ -252,6 +327,13 @@ async function init() {
     
     await fetchInitialData();
     connectSSE();
+    
+    // The server only pushes when data changes, keep "minutes until" current in between
+    setInterval(() => {
+        stopOrder.forEach(key => {
+            if (stopsByKey[key]) updateStopCard(stopsByKey[key]);
+        });
+    }, 15000);
 }
 
 init();
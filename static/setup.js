@@ -6,6 +6,7 @@ let currentCircle = null;
 let markersLayer = null;
 let selectedStop = null;
 let selectedLine = null;
+let linesByStop = {};  // Lines at each stop, by raw IDFM stop_id
 
 // Paris coordinates
 const PARIS_CENTER = [48.8566, 2.3522];
@@ -295,10 +296,19 @@ async function searchNearbyStops(lat, lon, showCircle = false) {
         displayNearbyResults(stops);
         
         // Show stops on map as pins
-        displayStopsOnMap(stops);
+        const markers = displayStopsOnMap(stops);
         
         hideStatus();
         
+        // Lines of all the stops in one request, to colour the pins
+        await fetchLinesAtStops(stops.map(stop => stop.stop_id_raw));
+        stops.forEach((stop, i) => {
+            const lines = linesByStop[stop.stop_id_raw];
+            if (lines && lines.length > 0) {
+                markers[i].setIcon(createCustomIcon(primaryTransport(lines)));
+            }
+        });
+        
     } catch (err) {
         console.error('Nearby search error:', err);
         document.getElementById('unified-results').innerHTML = 
@@ -373,11 +383,10 @@ function displayStopsOnMap(stops) {
     // Clear previous markers
     markersLayer.clearLayers();
     
-    stops.forEach(stop => {
-        // We'll need to determine transport type - for now use generic pin
-        // In production, you'd fetch lines at each stop to determine primary type
+    return stops.map(stop => {
+        // Generic pin until the lines at the stop are known
         const marker = L.marker([stop.lat, stop.lon], {
-            icon: createCustomIcon('bus') // Default to bus for now
+            icon: createCustomIcon('bus')
         }).addTo(markersLayer);
         
         // Fetch lines for popup
@@ -385,20 +394,42 @@ function displayStopsOnMap(stops) {
             const lines = await fetchLinesAtStop(stop.stop_id_raw);
             showStopPopup(marker, stop, lines);
         });
+        return marker;
     });
 }
 
-async function fetchLinesAtStop(stopIdRaw) {
+async function fetchLinesAtStops(stopIdsRaw) {
+    // One batch request for all the stops not fetched yet
+    const missing = [...new Set(stopIdsRaw)].filter(id => id && !(id in linesByStop));
+    if (missing.length === 0) return;
+    
     try {
-        const response = await fetch(`/api/stop/lines?stop_id=${encodeURIComponent(stopIdRaw)}`);
+        const response = await fetch('/api/stops/lines:batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ stop_ids: missing })
+        });
         const data = await response.json();
-        return data.results || [];
+        // Stops left out of the results could not be fetched: asked again next time
+        Object.assign(linesByStop, data.results || {});
+        Object.entries(data.errors || {}).forEach(([id, error]) => console.warn(`Lines at ${id}: ${error}`));
     } catch (err) {
         console.error('Error fetching lines:', err);
-        return [];
     }
 }
 
+async function fetchLinesAtStop(stopIdRaw) {
+    await fetchLinesAtStops([stopIdRaw]);
+    return linesByStop[stopIdRaw] || [];
+}
+
+function primaryTransport(lines) {
+    // Heaviest mode serving the stop
+    const order = ['metro', 'rer', 'train', 'tram', 'bus'];
+    const types = lines.map(line => line.transport_type);
+    return order.find(type => types.includes(type)) || 'bus';
+}
+
 function showStopPopup(marker, stop, lines) {
     const popupContent = `
         <div class="popup-stop-name">${stop.stop_name}</div>
@@ -454,9 +485,7 @@ async function showLinesAtStop(stopId, stopIdRaw, stopName) {
     modal.style.display = 'flex';
     
     try {
-        const response = await fetch(`/api/stop/lines?stop_id=${encodeURIComponent(stopIdRaw)}`);
-        const data = await response.json();
-        const lines = data.results || [];
+        const lines = await fetchLinesAtStop(stopIdRaw);
         
         if (lines.length === 0) {
             directionsList.innerHTML = '<div class="info-message">Aucune ligne trouvée</div>';
@@ -0,0 +1,54 @@
+"""
+Refresh engine behaviour when the config changes during a fetch
+"""
+import asyncio
+from datetime import datetime
+from typing import List
+
+from api.client import PARIS_TZ, RateBudget
+from api.config import ConfigManager
+from api.models import StopConfig, StopDepartures
+from api.refresh import RefreshEngine, stop_key
+
+
+class BlockingClient:
+    """Client whose requests wait until released"""
+
+    def __init__(self):
+        self.rate_budget = RateBudget()
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def get_departures_group(self, stop_configs: List[StopConfig]) -> List[StopDepartures]:
+        self.started.set()
+        await self.release.wait()
+        return [
+            StopDepartures(
+                stop_id=s.id, stop_name=s.name, line=s.line, direction=s.direction,
+                last_updated=datetime.now(PARIS_TZ), departures=[]
+            )
+            for s in stop_configs
+        ]
+
+
+def test_stop_removed_during_fetch_is_not_published(tmp_path):
+    config = ConfigManager(str(tmp_path / "config.yaml"), save_delay=0)
+    stop = StopConfig(id="STIF:StopPoint:Q:1:", name="Gare", line="Bus 42", direction="Nord")
+    config.add_stop(stop)
+    store = {}
+    engine = RefreshEngine(config, lambda: None, store)
+
+    async def scenario():
+        client = BlockingClient()
+        fetch = asyncio.create_task(engine.refresh_due(client, [[stop]]))
+        await client.started.wait()
+
+        config.remove_stop(stop.id, stop.direction)
+        client.release.set()
+        await fetch
+
+    asyncio.run(scenario())
+    config.flush()
+
+    assert stop_key(stop) not in store
+    assert stop.id not in engine._due